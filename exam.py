@@ -1,383 +1,158 @@
 import os
-import random
-import string
-import shutil
-import pandas as pd
+import json
+import hashlib
+import logging
+import functools
+import pickle
+import uuid
 from datetime import datetime
 from io import BytesIO
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from reportlab.platypus import Table, TableStyle, Paragraph
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
 import streamlit as st
 
-# === Config ===
-EXAM_HEADER = "Kenya Certificate of Secondary Examinations"
-
-DEFAULT_INSTRUCTIONS = [
-    "1. Write your name and index number in the spaces provided above.",
-    "2. Sign and write the date of examination in the spaces provided.",
-    "3. This paper consists of TWO sections: Section I and Section II.",
-    "4. Answer ALL the questions in Section I and only Five from Section II.",
-    "5. All answers and working must be written on the question paper in the spaces provided below each question.",
-    "6. Show all the steps in your calculations, giving answers at each stage in the spaces provided below each question.",
-    "7. Candidates should answer all questions in English.",
-    "8. Candidates should check to ascertain that all pages are printed as indicated and that no questions are missing."
-]
-
-# Default values for the new table customization
-DEFAULT_SECTION_1_QNS = 16
-DEFAULT_SECTION_2_QNS = 8
-DEFAULT_SECTION_1_TITLE = "SECTION I"
-DEFAULT_SECTION_2_TITLE = "SECTION II"
-DEFAULT_INCLUDE_GRAND_TOTAL = True
-
-# Default scale for the new complex table - Increased slightly for better default width
-DEFAULT_TABLE_SCALE = 1.1 # 1.0 means original size, 1.1 means 10% larger, 0.9 means 10% smaller
-
-# Default data for the custom marking table
-DEFAULT_CUSTOM_TABLE_DATA = pd.DataFrame([
-    {"Section": "A", "Question": "1 - 11", "Maximum Score": 25},
-    {"Section": "B", "Question": "12", "Maximum Score": 11},
-    {"Section": "B", "Question": "13", "Maximum Score": 11},
-    {"Section": "B", "Question": "14", "Maximum Score": 11},
-    {"Section": "B", "Question": "15", "Maximum Score": 10},
-    {"Section": "B", "Question": "16", "Maximum Score": 12},
-    {"Section": "TOTAL SCORE", "Question": "", "Maximum Score": 80},
-])
-
-def generate_exam_number(length=10):
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-
-def draw_kcse_standard_marking_table(c, examiner_text_y, table_scale, width, height,
-                                       section_1_questions, section_2_questions,
-                                       section_1_title, section_2_title, include_grand_total):
-    styles = getSampleStyleSheet()
-    normal_style = styles['Normal']
-    normal_style.fontSize = 9
-
-    # --- Table Dimensions ---
-    q_cell_width = 20 * table_scale
-    total_cell_width = 30 * table_scale
-    gt_label_width = 40 * table_scale
-    gt_score_width = 60 * table_scale
-    row_height = 25 * table_scale 
-    
-    # --- Table 1: Section I ---
-    col_widths_s1 = [q_cell_width] * section_1_questions + [total_cell_width]
-    
-    table_data_s1 = [
-        [section_1_title] + [''] * section_1_questions,
-        [str(i) for i in range(1, section_1_questions + 1)] + ['Total'],
-        [''] * (section_1_questions + 1)
-    ]
-    
-    table_s1 = Table(table_data_s1, colWidths=col_widths_s1, rowHeights=row_height)
-    table_s1_style = TableStyle([
-        ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ('FONTSIZE', (0,0), (-1,-1), 9),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('SPAN', (0,0), (section_1_questions,0)),
-        ('BACKGROUND', (0,0), (section_1_questions,0), colors.lightgrey),
-        ('FONTNAME', (0,0), (section_1_questions,0), 'Helvetica-Bold'),
-        ('FONTNAME', (0,1), (-1,1), 'Helvetica-Bold'),
-    ])
-    table_s1.setStyle(table_s1_style)
-
-    table_x_position = 60
-    table_s1_width, table_s1_height = table_s1.wrapOn(c, width, height)
-    table_s1_y_position = examiner_text_y - table_s1_height - 10 # Add 10 points space below 'For Examiner's Use Only'
-    table_s1.drawOn(c, table_x_position, table_s1_y_position)
-
-    # --- Table 2: Section II ---
-    sec2_q_start = section_1_questions + 1
-    sec2_q_end = sec2_q_start + section_2_questions - 1
-
-    col_widths_s2 = [q_cell_width] * section_2_questions + [total_cell_width]
-
-    table_data_s2 = [
-        [section_2_title] + [''] * section_2_questions,
-        [str(i) for i in range(sec2_q_start, sec2_q_end + 1)] + ['Total'],
-        [''] * (section_2_questions + 1)
-    ]
-
-    table_s2 = Table(table_data_s2, colWidths=col_widths_s2, rowHeights=row_height)
-    table_s2_style = TableStyle([
-        ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ('FONTSIZE', (0,0), (-1,-1), 9),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('SPAN', (0,0), (section_2_questions,0)),
-        ('BACKGROUND', (0,0), (section_2_questions,0), colors.lightgrey),
-        ('FONTNAME', (0,0), (section_2_questions,0), 'Helvetica-Bold'),
-        ('FONTNAME', (0,1), (-1,1), 'Helvetica-Bold'),
-    ])
-    table_s2.setStyle(table_s2_style)
-
-    table_s2_width, table_s2_height = table_s2.wrapOn(c, width, height)
-    # Add 15 points space between Section I and Section II tables
-    table_s2_y_position = table_s1_y_position - table_s2_height - 15 
-    table_s2.drawOn(c, table_x_position, table_s2_y_position)
-
-    # --- Table 3: Grand Total (if included) ---
-    if include_grand_total:
-        col_widths_gt = [gt_label_width, gt_score_width]
-        
-        table_data_gt = [
-            ['GRAND', ''],
-            ['TOTAL', ''],
-            ['', '']
-        ]
-
-        table_gt = Table(table_data_gt, colWidths=col_widths_gt, rowHeights=[row_height, row_height, row_height])
-        table_gt_style = TableStyle([
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-            ('FONTSIZE', (0,0), (-1,-1), 9),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('SPAN', (0,0), (0,1)), # 'GRAND' and 'TOTAL' label vertical span
-            ('SPAN', (1,0), (1,2)), # Grand Total score box vertical span
-            ('FONTNAME', (0,0), (0,1), 'Helvetica-Bold'),
-        ])
-        table_gt.setStyle(table_gt_style)
-
-        table_gt_width, table_gt_height = table_gt.wrapOn(c, width, height)
-        
-        # Position it to the right of Section II table, aligned at its top edge
-        table_gt_x_position = table_x_position + table_s2_width + 10 
-        table_gt_y_position = table_s2_y_position # Align tops of Section II and Grand Total tables
-        table_gt.drawOn(c, table_gt_x_position, table_gt_y_position)
-
-    # Return the lowest Y position used by the tables
-    return table_s2_y_position # or table_gt_y_position if it extends lower
-
-def draw_custom_marking_table(c, custom_table_df, examiner_text_y, table_scale, width, height):
-    styles = getSampleStyleSheet()
-    normal_style = styles['Normal']
-    normal_style.fontSize = 9
-
-    # Header for the custom table
-    table_header = ["SECTION", "QUESTION", "MAXIMUM SCORE", "CANDIDATE'S SCORE"]
-    
-    table_rows = []
-    # Add header
-    table_rows.append(table_header)
-
-    # Add data rows
-    for index, row in custom_table_df.iterrows():
-        section_val = str(row.get("Section", "")).strip()
-        question_val = str(row.get("Question", "")).strip()
-        max_score_val = str(row.get("Maximum Score", "")).strip()
-        table_rows.append([section_val, question_val, max_score_val, '']) # Candidate's score is empty
-
-    # Column widths can be dynamic based on content or fixed for better appearance
-    # Adjusted widths to better fit the example image
-    col_widths = [80 * table_scale, 80 * table_scale, 60 * table_scale, 80 * table_scale]
-    row_height = 25 * table_scale
-
-    table = Table(table_rows, colWidths=col_widths, rowHeights=row_height)
-    
-    table_style_list = [
-        ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ('FONTSIZE', (0,0), (-1,-1), 9),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey), # Header background
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'), # Header font bold
-    ]
-
-    # Apply specific styles for "TOTAL SCORE" row
-    for i, row_data in enumerate(table_rows):
-        if i > 0 and row_data[0].upper() == "TOTAL SCORE": # Check the 'Section' column for 'TOTAL SCORE'
-            # Span 'SECTION' and 'QUESTION' cells for 'TOTAL SCORE' row
-            table_style_list.append(('SPAN', (0, i), (1, i)))
-            table_style_list.append(('ALIGN', (0, i), (1, i), 'CENTER')) # Center merged cell
-            table_style_list.append(('FONTNAME', (0, i), (-1, i), 'Helvetica-Bold')) # Bold total row
-            table_style_list.append(('ALIGN', (2, i), (2, i), 'RIGHT')) # Align max score to right
-
-    table.setStyle(TableStyle(table_style_list))
-
-    table_x_position = 60
-    table_width, table_height = table.wrapOn(c, width, height)
-    table_y_position = examiner_text_y - table_height - 10 # Add 10 points space below 'For Examiner's Use Only'
-    table.drawOn(c, table_x_position, table_y_position)
-
-    return table_y_position # Return the lowest Y position used by the table
-
-
-def generate_exam_pdf(
-    student_name, adm_no, stream, form, subject, term, exam_name, exam_date,
-    duration, logo_image, raw_instructions, marking_table_style, include_exam_number,
-    school_name, paper_code, total_pages_count, table_scale,
-    section_1_questions, section_2_questions, section_1_title, section_2_title, include_grand_total,
-    custom_table_df, # New parameter for custom table data
-    prefill_student_details 
-):
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    
-    # Page Number
-    c.setFont("Helvetica", 9)
-    c.drawString(width - 70, height - 30, "1")
-
-    y = height - 80
-
-    # Draw logo if provided
-    if logo_image:
-        logo = ImageReader(logo_image)
-        c.drawImage(logo, 60, y - 10, width=60, height=60, preserveAspectRatio=True)
-
-    # Header information
-    c.setFont("Helvetica-Bold", 14)
-    c.drawCentredString(width / 2, y, EXAM_HEADER)
-
-    c.setFont("Helvetica-Bold", 13)
-    c.drawCentredString(width / 2, y - 20, school_name.upper())
-    
-    # Paper Code and Subject Title
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(60, y - 40, paper_code)
-    c.drawCentredString(width / 2, y - 40, f"{form.upper()} {subject.upper()}")
-    c.drawCentredString(width / 2, y - 60, f"{term} – {exam_name}")
-    
-    # Time
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(width - 150, y - 60, f"TIME: {duration}")
-
-    # --- Student details (Dashed Lines Under Names) ---
-    c.setFont("Helvetica", 11)
-    
-    line_start_x_left_section = 60
-    line_end_x_left_section = 320 
-    line_start_x_right_section = 330
-    line_end_x_right_section = width - 60 
-    line_thickness = 0.5 
-
-    c.setLineWidth(line_thickness)
-    c.setDash(1, 2) # Set dashed line pattern (1 unit on, 2 units off)
-
-    # Name
-    current_y = y - 90
-    c.drawString(line_start_x_left_section, current_y, "Name:")
-    name_label_width = c.stringWidth("Name:", "Helvetica", 11)
-    # Draw dashed line for name
-    c.line(line_start_x_left_section + name_label_width + 5, current_y - 2, line_end_x_left_section, current_y - 2)
-    # Draw student name over the dashed line ONLY if prefill_student_details is True
-    if prefill_student_details:
-        c.drawString(line_start_x_left_section + name_label_width + 5, current_y, student_name)
-
-    # Index No.
-    c.drawString(line_start_x_right_section, current_y, "Index No.:")
-    index_label_width = c.stringWidth("Index No.:", "Helvetica", 11)
-    # Draw dashed line for index
-    c.line(line_start_x_right_section + index_label_width + 5, current_y - 2, line_end_x_right_section, current_y - 2)
-    # Draw admission number over the dashed line ONLY if prefill_student_details is True
-    if prefill_student_details:
-        c.drawString(line_start_x_right_section + index_label_width + 5, current_y, adm_no)
-
-    # School
-    current_y -= 20 
-    c.drawString(line_start_x_left_section, current_y, "School:")
-    school_label_width = c.stringWidth("School:", "Helvetica", 11)
-    # Draw dashed line for school
-    c.line(line_start_x_left_section + school_label_width + 5, current_y - 2, line_end_x_left_section, current_y - 2)
-    # School name is always pre-filled
-    c.drawString(line_start_x_left_section + school_label_width + 5, current_y, school_name)
-
-    # Candidate's Signature
-    c.drawString(line_start_x_right_section, current_y, "Candidate's Signature:")
-    sig_label_width = c.stringWidth("Candidate's Signature:", "Helvetica", 11)
-    # Draw dashed line for signature
-    c.line(line_start_x_right_section + sig_label_width + 5, current_y - 2, line_end_x_right_section, current_y - 2)
-    
-    # Stream
-    current_y -= 20 
-    c.drawString(line_start_x_left_section, current_y, "Stream:")
-    stream_label_width = c.stringWidth("Stream:", "Helvetica", 11)
-    # Draw dashed line for stream
-    c.line(line_start_x_left_section + stream_label_width + 5, current_y - 2, line_end_x_left_section, current_y - 2)
-    # Draw stream over the dashed line ONLY if prefill_student_details is True
-    if prefill_student_details:
-        c.drawString(line_start_x_left_section + stream_label_width + 5, current_y, stream)
-
-    # Date
-    current_y -= 20 
-    c.drawString(line_start_x_left_section, current_y, "Date:")
-    date_label_width = c.stringWidth("Date:", "Helvetica", 11)
-    # Draw dashed line for date
-    c.line(line_start_x_left_section + date_label_width + 5, current_y - 2, line_end_x_left_section, current_y - 2)
-    # Date is always pre-filled
-    c.drawString(line_start_x_left_section + date_label_width + 5, current_y, exam_date)
-
-    # Exam Number (Bolded)
-    if include_exam_number:
-        c.setFont("Helvetica-Bold", 11) # Bold for exam number
-        c.drawString(line_start_x_right_section, current_y, f"Exam Number: {generate_exam_number()}")
-        c.setFont("Helvetica", 11) # Reset font
-
-    # Reset line styles
-    c.setDash() # Turn off dashes
-    c.setLineWidth(1)
-
-    # --- Instructions Handling (Dynamic First Instruction) ---
-    current_instructions = list(raw_instructions) # Create a mutable copy
-
-    if prefill_student_details:
-        # Modify the first instruction if pre-filling
-        if len(current_instructions) > 0 and "Write your name and index number" in current_instructions[0]:
-            current_instructions[0] = "1. Verify your name and index number in the spaces provided above."
-    # Else, if not pre-filling, the original instruction "Write your name..." remains.
-
-    c.setFont("Helvetica-Bold", 11)
-    iy = current_y - 40 # Adjust starting Y for instructions based on where student details ended
-    c.drawString(60, iy, "INSTRUCTIONS TO CANDIDATES")
-    
-    c.setFont("Helvetica", 10)
-    iy -= 20 # Initial vertical space before first instruction
-    for line in current_instructions: # Use the modified instructions list
-        p = Paragraph(line, getSampleStyleSheet()['Normal'])
-        p_width = width - 120 # 60 from each side
-        
-        # Corrected: p.wrapOn returns (width, height), so we need the second element (height)
-        _, p_height = p.wrapOn(c, p_width, height) 
-        
-        # Check if drawing this paragraph would go off the page
-        if iy - p_height < 60: # If it's too close to the bottom margin (e.g., 60 points)
-            c.showPage() # Start a new page
-            # Re-draw page number for new pages (basic for now, more complex if many pages)
-            c.setFont("Helvetica", 9)
-            c.drawString(width - 70, height - 30, "Page X") 
-            iy = height - 60 # Reset y for new page
-            c.setFont("Helvetica", 10)
-
-        p.drawOn(c, 60, iy - p_height) # Draw paragraph at current y, adjusted for its height
-        iy -= (p_height + 8) # Move y down for next paragraph, adding 8 points extra space
-
-
-    # --- For Examiner's Use Only Table ---
-    if marking_table_style != "None": # Only draw if a marking table style is selected
-        c.setFont("Helvetica-Bold", 12)
-        examiner_text_y = iy - 20 # Adjusted vertical spacing from instructions
-        c.drawString(60, examiner_text_y, "For Examiner's Use Only")
-
-        if marking_table_style == "K.C.S.E. Standard (Section I, Section II, Grand Total)":
-            draw_kcse_standard_marking_table(c, examiner_text_y, table_scale, width, height,
-                                              section_1_questions, section_2_questions,
-                                              section_1_title, section_2_title, include_grand_total)
-        elif marking_table_style == "Customized Score Sheet":
-            if custom_table_df is not None and not custom_table_df.empty:
-                draw_custom_marking_table(c, custom_table_df, examiner_text_y, table_scale, width, height)
-            else:
-                st.warning("No data provided for custom marking table. Skipping table generation.")
-
-
-    c.save()
-    buffer.seek(0)
-    return buffer
+from exam_render import (
+    DEFAULT_INSTRUCTIONS, DEFAULT_SECTION_1_QNS, DEFAULT_SECTION_2_QNS, DEFAULT_SECTION_1_TITLE,
+    DEFAULT_SECTION_2_TITLE, DEFAULT_INCLUDE_GRAND_TOTAL, DEFAULT_TABLE_SCALE, DEFAULT_CUSTOM_TABLE_DATA,
+    MARKING_TABLE_STYLES, prepare_logo,
+)
+from exam_roster import RosterColumnsError, RosterIndex, load_roster, pdf_filename, roster_problems
+from exam_batch import default_worker_count, render_batch, render_class_sets, render_papers, write_batch_zip
+from exam_metrics import RunMetrics, profiled
+from exam_jobs import get_job, submit_job
+from exam_numbers import number_paper_rosters
+from exam_manifest import load_papers, paper_exam_configs
+from exam_cache import PdfCache, config_fingerprint
+from exam_checkpoint import BatchCheckpoint
+from exam_preview import pdf_page_images, preview_pdf, preview_student
+
+# Longest list of matching students offered at once in the student picker
+MAX_PICKER_OPTIONS = 200
+
+# Structured timing lines from exam_metrics go to the server log
+metrics_logger = logging.getLogger("exam_metrics")
+if not metrics_logger.handlers:
+    metrics_logger.addHandler(logging.StreamHandler())
+    metrics_logger.setLevel(logging.INFO)
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def read_roster_cached(roster_bytes, filename):
+    # Keyed on the uploaded file's content, so reruns don't parse the same roster again. Shared rather
+    # than copied on every rerun (as st.cache_data would), so callers must not modify the list.
+    return load_roster(BytesIO(roster_bytes), filename)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def roster_problems_cached(roster_bytes, filename):
+    return roster_problems(read_roster_cached(roster_bytes, filename))
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def preview_cached(config_digest, record, _exam_config):
+    # Keyed on the config fingerprint; Streamlit does not hash the underscored argument itself
+    pdf_bytes = preview_pdf(_exam_config, record)
+    try:
+        return pdf_bytes, pdf_page_images(pdf_bytes)
+    except ImportError:
+        return pdf_bytes, None
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def roster_index_cached(roster_bytes, filename):
+    # Built once per uploaded roster and shared, read-only, by every rerun, so a keystroke in the search
+    # box costs a lookup rather than a rebuild or an unpickled copy
+    return RosterIndex(read_roster_cached(roster_bytes, filename))
+
+def generation_key(roster_bytes, exam_config, output_mode, split_by_stream, paper_list=None):
+    """Fingerprint of everything that changes the generated download (but not how it is generated)."""
+    fingerprint = (hashlib.sha256(roster_bytes).hexdigest(), config_fingerprint(exam_config), output_mode, split_by_stream, paper_list)
+    return hashlib.sha256(pickle.dumps(fingerprint)).hexdigest()
+
+def generate_download(job, records, exam_config, output_mode, split_by_stream, capture_profile, metrics, key,
+                      paper_configs=None):
+    """Render the batch for a background job and return what the page needs to offer the download.
+
+    With ``paper_configs`` every paper is rendered for the whole roster into one
+    ZIP with a folder per paper. Every finished file is checkpointed under
+    ``key``, so a run that was interrupted (or a restarted app) picks up where
+    it stopped when the same download is requested again. Runs on a job thread
+    with job.granted_workers worker processes, so it must not call any st.*
+    functions.
+    """
+    profile_path = os.path.join(job.workspace, "generation.prof") if capture_profile else None
+    worker_count = job.granted_workers
+
+    last_stats = []
+
+    def on_progress(stats):
+        last_stats[:] = [stats]
+        job.report_progress(stats.done) # Raises JobCancelled once the user cancels
+
+    with profiled(profile_path), BatchCheckpoint(key) as checkpoint:
+        reused_archive = checkpoint.finished
+        with metrics.stage("exam_numbers"):
+            paper_rosters = number_paper_rosters(records, paper_configs or [exam_config])
+
+        # Unchanged students are reused from earlier runs; class sets are always rendered whole
+        cache = PdfCache() if output_mode == "ZIP of individual PDFs" else None
+
+        if paper_configs:
+            pdf_files = render_papers(paper_rosters, class_sets=output_mode == "Single merged PDF (class set)",
+                                      split_by_stream=split_by_stream, workers=worker_count,
+                                      on_progress=on_progress, metrics=metrics, cache=cache, checkpoint=checkpoint)
+        elif output_mode == "Single merged PDF (class set)":
+            pdf_files = render_class_sets(paper_rosters[0][1], exam_config, split_by_stream=split_by_stream,
+                                          workers=worker_count, on_progress=on_progress, metrics=metrics,
+                                          checkpoint=checkpoint)
+        else:
+            pdf_files = render_batch(paper_rosters[0][1], exam_config, workers=worker_count,
+                                     on_progress=on_progress, metrics=metrics, cache=cache, checkpoint=checkpoint)
+
+        if output_mode == "Single merged PDF (class set)" and not split_by_stream and not paper_configs:
+            [(_, class_set_pdf)] = list(pdf_files)
+            metrics.count("pdf_bytes", len(class_set_pdf))
+            download = dict(label="⬇️ Download Class Set (PDF File)", data=class_set_pdf,
+                            file_name="Personalized_Exam_Top_Pages.pdf", mime="application/pdf")
+        else:
+            # Streamlit keeps download payloads in memory, so this is the one full copy of the archive
+            with checkpoint.archive(pdf_files, metrics=metrics) as zip_file, metrics.stage("download_payload"):
+                download = dict(label="⬇️ Download All PDFs (ZIP File)", data=zip_file.read(),
+                                file_name="Personalized_Exam_Top_Pages.zip", mime="application/zip")
+
+    profile = None
+    if profile_path:
+        with open(profile_path, "rb") as f:
+            profile = f.read()
+
+    summary = None
+    if last_stats:
+        stats = last_stats[0]
+        papers = f" for {len(paper_configs)} papers" if paper_configs else ""
+        summary = (
+            f"Rendered {stats.pages} pages{papers} in {stats.elapsed:.1f} seconds "
+            f"({stats.pages_per_second:.1f} pages/second) using {stats.workers} worker process(es)."
+        )
+        if stats.cached:
+            summary += f" {stats.cached} unchanged PDFs were reused from earlier runs."
+        if stats.resumed:
+            summary += f" {stats.resumed} PDFs were picked up from an interrupted run."
+    elif reused_archive:
+        summary = "These PDFs had already been generated, so the finished download was reused."
+    return dict(key=key, download=download, summary=summary, report=metrics.log_report(), profile=profile)
+
+def render_selection(records, exam_config, paper_configs, positions):
+    """The pages of the picked students (roster positions): one PDF for a single page, otherwise a ZIP.
+
+    Used as a download button's data, so nothing is rendered until the button
+    is clicked. Exam numbers and file names are the ones the full batch uses.
+    """
+    paper_rosters = number_paper_rosters(records, paper_configs or [exam_config])
+    # A handful of pages: rendered in this thread, with unchanged ones taken from the cache
+    cache = PdfCache()
+    if paper_configs:
+        pdf_files = render_papers(paper_rosters, workers=1, cache=cache, only=set(positions))
+    else:
+        pdf_files = render_batch(paper_rosters[0][1], exam_config, workers=1, cache=cache, only=set(positions))
+    if len(positions) == 1 and not paper_configs:
+        [(_, pdf_bytes)] = list(pdf_files)
+        return pdf_bytes
+    with write_batch_zip(pdf_files) as zip_file:
+        return zip_file.read()
 
 # === Streamlit UI ===
 st.title("Student Customized Exam Top Page Generator")
@@ -391,8 +166,14 @@ st.header("School and Exam Details (for PDF Generation)")
 school_name = st.text_input("Enter School Name", value="ST. JOSEPH’S BOYS - KITALE")
 
 st.subheader("Upload Files")
-student_file = st.file_uploader("Upload an Excel File with Student Data", type=["xlsx"], key="student_excel_upload")
+student_file = st.file_uploader("Upload an Excel or CSV File with Student Data", type=["xlsx", "csv"], key="student_excel_upload")
 logo_file = st.file_uploader("Upload Your School Logo (Optional)", type=["png", "jpg", "jpeg"], key="school_logo_upload")
+papers_file = st.file_uploader(
+    "Upload a Paper List to Generate Several Exams at Once (Optional)",
+    type=["csv", "xlsx", "yaml", "yml", "json"], key="paper_list_upload",
+    help="One row per paper, with columns such as 'Subject', 'Paper Code', 'Duration' and 'Marking Table Style'. "
+         "Anything a paper leaves blank is taken from this form. Every paper is generated for every student, in a folder per paper."
+)
 
 st.subheader("Exam Information")
 paper_code = st.text_input("Paper Code (e.g., 121/1)", value="121/1", help="This appears at the top left of the exam paper.")
@@ -405,7 +186,25 @@ duration = st.text_input("Exam Duration", value="2 HOURS")
 
 st.subheader("Page Options")
 prefill_student_details = st.checkbox("Pre-fill student name, index number, and stream", value=True, help="If checked, names, index numbers, and streams from your Excel file will be printed. If unchecked, lines will be provided for students to write them in.")
-include_exam_number = st.checkbox("Include an Exam Number on the page", value=True)
+include_exam_number = st.checkbox("Include an Exam Number on the page", value=True, help="Each student keeps the same exam number whenever this paper is generated again.")
+output_mode = st.radio(
+    "Output Format",
+    ("ZIP of individual PDFs", "Single merged PDF (class set)"),
+    help="A merged class set is one multi-page PDF that the print room can send to the printer in one go."
+)
+split_by_stream = False
+if output_mode == "Single merged PDF (class set)":
+    split_by_stream = st.checkbox("Make a separate class set for each stream", value=False, help="Uses the 'Stream' column of your Excel file. The class sets are downloaded together as a ZIP file.")
+worker_count = st.number_input(
+    "Worker processes",
+    min_value=1, max_value=default_worker_count(), value=default_worker_count(), step=1,
+    help="How many CPU cores to use when generating the PDFs. Large class lists finish faster with more workers."
+)
+capture_profile = st.checkbox(
+    "Capture a performance profile of the run",
+    value=False,
+    help="Records a cProfile dump of the generation that you can download afterwards. Rendering inside worker processes shows up as waiting time."
+)
 
 st.markdown("---")
 
@@ -419,7 +218,7 @@ st.header("Customize Marking Table (Examiner's Use Only)")
 
 marking_table_style = st.radio(
     "Choose Marking Table Style:",
-    ("K.C.S.E. Standard (Section I, Section II, Grand Total)", "Customized Score Sheet", "None"),
+    MARKING_TABLE_STYLES,
     index=0, # Default to K.C.S.E. Standard
     help="Select the layout for the 'For Examiner's Use Only' table."
 )
@@ -486,85 +285,223 @@ table_scale = st.slider(
 
 st.markdown("---")
 
+# Shared by every student; the logo goes to the worker processes as prepared bytes
+exam_config = dict(
+    form=form,
+    subject=subject,
+    term=term,
+    exam_name=exam_name,
+    exam_date=datetime.strftime(exam_date, "%d %B %Y"),
+    duration=duration,
+    logo_image=prepare_logo(logo_file) if logo_file else None,
+    raw_instructions=instruction_lines,
+    marking_table_style=marking_table_style, # Pass the chosen style
+    include_exam_number=include_exam_number,
+    school_name=school_name,
+    paper_code=paper_code,
+    total_pages_count=1,
+    table_scale=table_scale,
+    section_1_questions=section_1_questions,
+    section_2_questions=section_2_questions,
+    section_1_title=section_1_title,
+    section_2_title=section_2_title,
+    include_grand_total=include_grand_total,
+    custom_table_df=custom_table_df, # Pass custom table data
+    prefill_student_details=prefill_student_details
+)
+
+paper_list = None
+if papers_file is not None:
+    try:
+        paper_list = load_papers(papers_file)
+    except Exception as e:
+        st.error(f"We couldn't read your paper list: {e}")
+
+roster_bytes = student_file.getvalue() if student_file is not None else None
+# Read once here, so the preview, the student picker and the Generate button all see the same roster
+roster_records = None
+roster_unreadable = False
+if roster_bytes:
+    try:
+        roster_records = read_roster_cached(roster_bytes, student_file.name)
+    except RosterColumnsError:
+        pass # Explained when the user clicks Generate
+    except Exception as e:
+        roster_unreadable = True
+        st.error(f"We couldn't read your student list: {e}. Please check the file, or save it again as .xlsx or CSV.")
+if roster_records is not None:
+    problems = roster_problems_cached(roster_bytes, student_file.name)
+    if problems:
+        st.warning("**Please check your student list before generating:**\n" + "\n".join(f"- {problem}" for problem in problems))
+st.header("Preview")
+if marking_table_style == "Customized Score Sheet" and (custom_table_df is None or custom_table_df.empty):
+    st.info("Add some rows to your custom marking table to see a preview.")
+else:
+    # The allocated exam number is part of the record, so the cached preview is redrawn once one exists
+    preview_record = preview_student(roster_records, exam_config)
+    preview_pdf_bytes, preview_images = preview_cached(config_fingerprint(exam_config), preview_record, exam_config)
+    caption = f"Page for {preview_record.student_name} ({preview_record.adm_no}), as it will be generated."
+    if include_exam_number and preview_record.exam_number is None:
+        caption += " The exam number shown is a placeholder; numbers are given out when the PDFs are generated."
+    if paper_list:
+        caption += " Papers in your paper list can change some of these settings."
+    if preview_images:
+        st.image(preview_images, caption=[caption] + [""] * (len(preview_images) - 1), width="stretch")
+    else:
+        st.caption(caption + " Install PyMuPDF (pip install pymupdf) to see the preview here.")
+        st.download_button("Open preview (PDF)", data=preview_pdf_bytes, file_name="Preview.pdf",
+                           mime="application/pdf", key="download_preview")
+
+st.header("Pages for Individual Students")
+roster_index = roster_index_cached(roster_bytes, student_file.name) if roster_records is not None else None
+if roster_index is None:
+    st.info("Upload your student list to look up students and download just their pages.")
+else:
+    st.markdown("Need a few replacement pages? Find the students here; only their pages are generated, when you download them.")
+    search_column, stream_column = st.columns([2, 1])
+    search_text = search_column.text_input("Search by name or admission number", key="student_search")
+    stream_choice = stream_column.selectbox("Stream", ["All streams"] + roster_index.streams, key="student_stream_filter")
+    matches = roster_index.search(search_text, None if stream_choice == "All streams" else stream_choice)
+    # Students picked under an earlier search stay picked
+    picked_before = [position for position in st.session_state.get("picked_students", []) if position < len(roster_index.records)]
+    options = sorted(set(matches[:MAX_PICKER_OPTIONS]) | set(picked_before))
+    picked = st.multiselect(
+        f"Students ({len(matches)} found" + (f", showing the first {MAX_PICKER_OPTIONS}" if len(matches) > MAX_PICKER_OPTIONS else "") + ")",
+        options, key="picked_students",
+        format_func=lambda position: "{0.student_name} ({0.adm_no}) - {0.stream}".format(roster_index.records[position]),
+    )
+    picker_configs = None
+    try:
+        picker_configs = paper_exam_configs(exam_config, paper_list, allow_logo_path=False) if paper_list else None
+    except (OSError, ValueError) as e:
+        st.error(f"One of the papers in your paper list has a problem: {e}")
+    else:
+        single_page = len(picked) == 1 and not picker_configs
+        record = roster_index.records[picked[0]] if picked else None
+        st.download_button(
+            f"⬇️ Download Pages for {len(picked)} Selected Student(s)",
+            data=functools.partial(render_selection, roster_index.records, exam_config, picker_configs, picked),
+            file_name=pdf_filename(record.student_name, record.adm_no) if single_page else "Selected_Exam_Top_Pages.zip",
+            mime="application/pdf" if single_page else "application/zip",
+            disabled=not picked or (marking_table_style == "Customized Score Sheet" and (custom_table_df is None or custom_table_df.empty)),
+            on_click="ignore", key="download_selected",
+        )
+
+current_generation_key = generation_key(roster_bytes, exam_config, output_mode, split_by_stream, paper_list) if roster_bytes else None
+
+# The job ID also goes in the page URL, so a reloaded or reopened page can pick the job up again
+job_id = st.session_state.get("generation_job_id") or st.query_params.get("job")
+job = get_job(job_id) if job_id else None
+if job is not None and not job.active:
+    if job.status == "done":
+        st.session_state["generated_pdfs"] = job.result
+    elif job.status == "cancelled":
+        st.warning("PDF generation was cancelled.")
+    else:
+        st.error(f"Something went wrong while generating the PDFs: {job.error}")
+    st.session_state.pop("generation_job_id", None)
+    st.query_params.pop("job", None)
+    job = None
+
+# A generated download is only kept while everything it was built from stays the same
+generated = st.session_state.get("generated_pdfs")
+if generated and generated["key"] != current_generation_key:
+    del st.session_state["generated_pdfs"]
+    generated = None
+    st.info("Your inputs changed since the last generation. Click the button below to generate the PDFs again.")
+
 if st.button("Generate Personalized PDFs", key="generate_pdfs_button"):
     if student_file is None:
-        st.error("Oops! Please upload an Excel file with your student data before generating PDFs.")
+        st.error("Oops! Please upload an Excel or CSV file with your student data before generating PDFs.")
+    elif roster_unreadable:
+        st.error("Please upload a student list that can be read (see the message above) before generating PDFs.")
+    elif papers_file is not None and paper_list is None:
+        st.error("Please fix or remove the paper list before generating PDFs.")
     elif marking_table_style == "Customized Score Sheet" and (custom_table_df is None or custom_table_df.empty):
         st.error("Please add some data to your 'Customized Score Sheet' marking table or select another style.")
+    elif job is not None:
+        st.info("Your PDFs are already being generated. You can follow the progress below.")
+    elif generated:
+        st.info("Nothing has changed since the last generation, so your PDFs below are already up to date.")
+    else:
+        metrics = RunMetrics()
+        paper_configs = None
+        try:
+            if paper_list:
+                # Uploaded by a user of this shared app, so it must not point the server at its own files
+                paper_configs = paper_exam_configs(exam_config, paper_list, allow_logo_path=False)
+            with metrics.stage("read_roster"):
+                records = read_roster_cached(roster_bytes, student_file.name)
+        except RosterColumnsError:
+            records = None
+            st.error("""
+                **Important:** We couldn't find the necessary columns in your Excel file.
+                Please make sure your file has columns named something like:
+                - 'Name' (for student names)
+                - 'Admission No.' or 'Adm' or 'Index No.' (for index numbers)
+                - 'Stream' (for student streams)
+                Double-check your Excel file and try again!
+            """)
+        except (OSError, ValueError) as e:
+            records = None
+            st.error(f"One of the papers in your paper list has a problem: {e}")
+
+        if records is not None:
+            single_class_set = output_mode == "Single merged PDF (class set)" and not split_by_stream and not paper_configs
+            job = submit_job(
+                functools.partial(generate_download, records=records, exam_config=exam_config, output_mode=output_mode,
+                                  split_by_stream=split_by_stream,
+                                  capture_profile=capture_profile, metrics=metrics, key=current_generation_key,
+                                  paper_configs=paper_configs),
+                total=len(records) * len(paper_configs or [exam_config]),
+                key=current_generation_key,
+                # Everyone using this server shares its CPUs; each browser session gets its turn in the queue
+                owner=st.session_state.setdefault("session_owner", uuid.uuid4().hex),
+                # A single class set is drawn by one process however many are free
+                workers=1 if single_class_set else worker_count,
+            )
+            st.session_state["generation_job_id"] = job.id
+            st.query_params["job"] = job.id
+
+@st.fragment(run_every=1)
+def show_job_progress(job_id):
+    job = get_job(job_id)
+    if job is None or not job.active:
+        st.rerun() # Let the whole page pick up the finished job
+    if job.status == "queued":
+        position = job.queue_position
+        text = "Waiting for a free generator..." if position is None else \
+            f"Waiting for a free generator: number {position} in the queue..."
     else:
-        with st.spinner("Generating PDFs... This might take a moment if you have many students."):
-            df = pd.read_excel(student_file)
-            df.columns = [col.strip().lower() for col in df.columns]
-
-            name_col = next((col for col in df.columns if "name" in col), None)
-            adm_col = next((col for col in df.columns if "admission" in col or "adm" in col or "index" in col), None)
-            stream_col = next((col for col in df.columns if "stream" in col), None)
-
-            if not all([name_col, adm_col]):
-                st.error("""
-                    **Important:** We couldn't find the necessary columns in your Excel file.
-                    Please make sure your file has columns named something like:
-                    - 'Name' (for student names)
-                    - 'Admission No.' or 'Adm' or 'Index No.' (for index numbers)
-                    - 'Stream' (for student streams)
-                    Double-check your Excel file and try again!
-                """)
-            else:
-                output_folder = "student_exam_pdfs"
-                if os.path.exists(output_folder):
-                    shutil.rmtree(output_folder)
-                os.makedirs(output_folder, exist_ok=True)
-
-                for index, row in df.iterrows():
-                    student_name = str(row.get(name_col, "Unknown")).strip()
-                    adm_no = str(row.get(adm_col, "N/A")).strip()
-                    stream = str(row.get(stream_col, "N/A")).strip() if stream_col else "N/A"
-
-                    pdf = generate_exam_pdf(
-                        student_name=student_name,
-                        adm_no=adm_no,
-                        stream=stream,
-                        form=form,
-                        subject=subject,
-                        term=term,
-                        exam_name=exam_name,
-                        exam_date=datetime.strftime(exam_date, "%d %B %Y"),
-                        duration=duration,
-                        logo_image=logo_file,
-                        raw_instructions=instruction_lines,
-                        marking_table_style=marking_table_style, # Pass the chosen style
-                        include_exam_number=include_exam_number,
-                        school_name=school_name,
-                        paper_code=paper_code,
-                        total_pages_count=1,
-                        table_scale=table_scale,
-                        section_1_questions=section_1_questions,
-                        section_2_questions=section_2_questions,
-                        section_1_title=section_1_title,
-                        section_2_title=section_2_title,
-                        include_grand_total=include_grand_total,
-                        custom_table_df=custom_table_df, # Pass custom table data
-                        prefill_student_details=prefill_student_details
-                    )
-
-                    safe_name = student_name.replace(" ", "_").replace("/", "_").replace("\\", "_")
-                    safe_adm_no = str(adm_no).replace(" ", "_").replace("/", "_").replace("\\", "_")
-                    filename = f"{safe_name}_{safe_adm_no}.pdf"
-                    
-                    with open(os.path.join(output_folder, filename), "wb") as f:
-                        f.write(pdf.read())
-
-                zip_path = shutil.make_archive("Personalized_Exam_Top_Pages", 'zip', output_folder)
-                st.success("🎉 **Success!** Your personalized PDFs are ready!")
-                
-                with open(zip_path, "rb") as fp:
-                    st.download_button(
-                        label="⬇️ Download All PDFs (ZIP File)",
-                        data=fp.read(),
-                        file_name="Personalized_Exam_Top_Pages.zip",
-                        mime="application/zip"
-                    )
-                
-                st.info("Temporary files are being cleaned up now.")
-                shutil.rmtree(output_folder)
-                os.remove(zip_path)
\ No newline at end of file
+        text = f"Generated {job.done} of {job.total} PDFs"
+        if job.eta_seconds is not None:
+            text += f" (about {job.eta_seconds:.0f} seconds left)"
+    st.progress(job.done / job.total if job.total else 0.0, text=text)
+    if st.button("Cancel generation", key="cancel_generation"):
+        job.cancel()
+        st.info("Stopping after the PDFs that are already being drawn...")
+
+if job is not None:
+    show_job_progress(job.id)
+
+if generated:
+    st.success("🎉 **Success!** Your personalized PDFs are ready!")
+    if generated["summary"]:
+        st.caption(generated["summary"])
+    st.download_button(**generated["download"])
+
+    report = generated["report"]
+    with st.expander("Generation details"):
+        counters = report["counters"]
+        columns = st.columns(4)
+        columns[0].metric("Total time", f"{report['total_seconds']:.1f} s")
+        columns[1].metric("Pages", counters.get("pages", 0))
+        if report["page_render_ms_p50"] is not None:
+            columns[2].metric("Per-page render (p50 / p95)", f"{report['page_render_ms_p50']:.1f} / {report['page_render_ms_p95']:.1f} ms")
+        columns[3].metric("Bytes written", f"{counters.get('archive_bytes', counters.get('pdf_bytes', 0)) / 1024:,.0f} KB")
+        st.table([{"Stage": stage, "Seconds": round(seconds, 3)} for stage, seconds in report["stages"].items()])
+        st.download_button("Download timing report (JSON)", data=json.dumps(report, indent=2),
+                           file_name="generation_report.json", mime="application/json", key="download_report")
+        if generated.get("profile"):
+            st.download_button("Download cProfile dump", data=generated["profile"], file_name="generation.prof",
+                               mime="application/octet-stream", key="download_profile")
@@ -0,0 +1,312 @@
+import os
+import time
+import zipfile
+import tempfile
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+from exam_render import ExamPageTemplate
+from exam_cache import config_fingerprint, student_cache_key
+from exam_roster import pdf_filename, safe_filename_part, unique_filenames
+
+# ZIP archives stay in memory up to this size, then spill over to a temporary file on disk
+ZIP_SPOOL_LIMIT = 8 * 1024 * 1024
+
+# Starting a worker process costs about as much as rendering this many PDFs, so a
+# small incremental run (a few changed students) stays in-process
+MIN_PDFS_PER_WORKER = 50
+
+# Exam configs sent to each worker process, and the templates built from them on first use.
+# Thread-local because single-worker batches render in the calling thread, and two
+# background jobs may be doing that at the same time.
+_worker_state = threading.local()
+
+def default_worker_count():
+    return os.cpu_count() or 1
+
+def paper_folders(exam_configs):
+    """Folder name for each paper of a multi-exam run, e.g. "121_1_MATHEMATICS", made unique."""
+    folders = []
+    for exam_config in exam_configs:
+        folders.append("_".join(safe_filename_part(exam_config[key]) for key in ("paper_code", "subject")
+                                if exam_config.get(key)) or "Paper")
+    return unique_filenames(folders)
+
+class BatchStats:
+    """Running totals for a batch, handed to the progress callback after every student."""
+
+    def __init__(self, total, workers):
+        self.total = total
+        self.workers = workers
+        self.done = 0
+        self.pages = 0
+        self.cached = 0
+        self.resumed = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def pages_per_second(self):
+        elapsed = self.elapsed
+        return self.pages / elapsed if elapsed > 0 else 0.0
+
+def _init_worker(exam_configs):
+    _worker_state.configs = tuple(exam_configs)
+    _worker_state.templates = {}
+
+def _worker_template(paper):
+    # Built on first use, so a worker only pays for the papers it is actually given
+    template = _worker_state.templates.get(paper)
+    if template is None:
+        template = _worker_state.templates[paper] = ExamPageTemplate(**_worker_state.configs[paper])
+    return template
+
+def _render_student(item):
+    paper, record = item
+    started = time.perf_counter()
+    template = _worker_template(paper)
+    pdf = template.render(record.student_name, record.adm_no, record.stream, record.exam_number)
+    return pdf.getvalue(), len(template.pages), time.perf_counter() - started
+
+def _run_in_workers(func, items, exam_configs, workers, chunksize=1):
+    """Yield func(item) for every item, in order, on a process pool when workers > 1."""
+    if workers == 1:
+        _init_worker(exam_configs)
+        yield from map(func, items)
+        return
+
+    # spawn rather than fork: the Streamlit server process runs several threads
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(exam_configs,),
+    )
+    try:
+        yield from pool.map(func, items, chunksize=chunksize)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+def _timed_results(results, metrics):
+    """Pass worker results through, recording render times and the wait for them in ``metrics``."""
+    results = iter(results)
+    while True:
+        started = time.perf_counter()
+        try:
+            pdf_bytes, page_count, render_seconds = next(results)
+        except StopIteration:
+            return
+        if metrics:
+            metrics.add_time("render", time.perf_counter() - started)
+            metrics.add_render(render_seconds, page_count)
+        yield pdf_bytes, page_count
+
+def _resumed(entries, checkpoint):
+    return [checkpoint is not None and filename in checkpoint for filename, _, _ in entries]
+
+def _render_students(entries, exam_configs, workers, on_progress, metrics, cache=None, checkpoint=None):
+    """Render (filename, paper index, record) entries, yielding (filename, pdf_bytes) in order.
+
+    With a ``cache`` (an exam_cache.PdfCache) only students without a cached PDF
+    are sent to the workers; the rest are read back from the cache as their turn
+    comes, and newly rendered PDFs are added to it. Files already completed in
+    ``checkpoint`` (an exam_checkpoint.BatchCheckpoint) are read back from it,
+    and every other file is recorded there once it is done.
+    """
+    resumed = _resumed(entries, checkpoint)
+    keys = [None] * len(entries)
+    if cache is not None:
+        digests = [config_fingerprint(exam_config) for exam_config in exam_configs]
+        keys = [student_cache_key(digests[paper], exam_configs[paper], record) for _, paper, record in entries]
+    hits = [not done and key is not None and cache.has(key) for key, done in zip(keys, resumed)]
+    items = [(paper, record) for (_, paper, record), hit, done in zip(entries, hits, resumed) if not (hit or done)]
+
+    workers = max(1, min(workers or default_worker_count(), -(-len(items) // MIN_PDFS_PER_WORKER)))
+    stats = BatchStats(len(entries), workers)
+    chunksize = max(1, min(64, len(items) // (workers * 4)))
+
+    results = _timed_results(_run_in_workers(_render_student, items, exam_configs, workers, chunksize), metrics)
+    for (filename, paper, record), key, hit, done in zip(entries, keys, hits, resumed):
+        pdf_bytes = checkpoint.get(filename) if done else None
+        if pdf_bytes is not None:
+            stats.resumed += 1
+        else:
+            pdf_bytes = cache.get(key) if hit else None
+            if pdf_bytes is not None:
+                stats.cached += 1
+            else:
+                if hit or done: # Evicted or damaged since it was looked up, so render it here
+                    _init_worker(exam_configs)
+                    pdf_bytes, page_count, _ = _render_student((paper, record))
+                else:
+                    pdf_bytes, page_count = next(results)
+                stats.pages += page_count
+                if key is not None:
+                    started = time.perf_counter()
+                    cache.put(key, pdf_bytes)
+                    if metrics:
+                        metrics.add_time("cache_write", time.perf_counter() - started)
+            if checkpoint is not None:
+                started = time.perf_counter()
+                checkpoint.record(filename, pdf_bytes)
+                if metrics:
+                    metrics.add_time("checkpoint_write", time.perf_counter() - started)
+        stats.done += 1
+        if on_progress:
+            on_progress(stats)
+        yield filename, pdf_bytes
+
+    if metrics and cache is not None:
+        metrics.count("cached_pdfs", stats.cached)
+    if metrics and checkpoint is not None:
+        metrics.count("resumed_pdfs", stats.resumed)
+
+def render_batch(records, exam_config, workers=None, on_progress=None, metrics=None, cache=None, checkpoint=None,
+                 only=None):
+    """Render a PDF per student, yielding (filename, pdf_bytes) in roster order.
+
+    exam_config holds the ExamPageTemplate keyword arguments. It is sent to every
+    worker process once, so it must be picklable: pass the logo as bytes, not as
+    an uploaded file object. The roster is sharded across ``workers`` processes
+    (all cores by default); with a single worker everything renders in-process.
+    Render timings are added to ``metrics`` (an exam_metrics.RunMetrics) if given.
+    Students whose PDF is already in ``cache`` (an exam_cache.PdfCache) are not
+    rendered again, and neither are those completed in ``checkpoint`` (an
+    exam_checkpoint.BatchCheckpoint) by an interrupted run. With ``only`` (roster
+    positions) just those students are rendered, under the file names they get
+    in the full batch.
+    """
+    records = list(records)
+    filenames = unique_filenames(pdf_filename(record.student_name, record.adm_no) for record in records)
+    entries = [(filename, 0, record) for position, (filename, record) in enumerate(zip(filenames, records))
+               if only is None or position in only]
+    yield from _render_students(entries, [exam_config], workers, on_progress, metrics, cache, checkpoint)
+
+def _render_class_set(item):
+    paper, records = item
+    started = time.perf_counter()
+    template = _worker_template(paper)
+    buffer = BytesIO()
+    c = template.new_canvas(buffer)
+    for record in records:
+        template.draw(c, record.student_name, record.adm_no, record.stream, record.exam_number)
+    c.save()
+    return buffer.getvalue(), len(records) * len(template.pages), time.perf_counter() - started
+
+def _class_sets(records, split_by_stream):
+    if not split_by_stream:
+        return [("Class_Set.pdf", records)]
+    class_sets = {}
+    for record in records:
+        class_sets.setdefault(record.stream, []).append(record)
+    filenames = unique_filenames(pdf_filename(stream, "Class_Set") for stream in class_sets)
+    return list(zip(filenames, class_sets.values()))
+
+def _render_class_set_entries(entries, exam_configs, workers, on_progress, metrics, checkpoint=None):
+    """Render (filename, paper index, records) entries as merged PDFs, yielding (filename, pdf_bytes) in order.
+
+    Class sets already completed in ``checkpoint`` are read back from it, and
+    every other one is recorded there once it is done.
+    """
+    resumed = _resumed(entries, checkpoint)
+    items = [(paper, members) for (_, paper, members), done in zip(entries, resumed) if not done]
+    workers = max(1, min(workers or default_worker_count(), len(items) or 1))
+    stats = BatchStats(sum(len(members) for _, _, members in entries), workers)
+
+    results = _timed_results(_run_in_workers(_render_class_set, items, exam_configs, workers), metrics)
+    for (filename, paper, members), done in zip(entries, resumed):
+        pdf_bytes = checkpoint.get(filename) if done else None
+        if pdf_bytes is not None:
+            stats.resumed += 1
+        else:
+            if done: # Damaged since it was looked up, so render it here
+                _init_worker(exam_configs)
+                pdf_bytes, page_count, _ = _render_class_set((paper, members))
+            else:
+                pdf_bytes, page_count = next(results)
+            stats.pages += page_count
+            if checkpoint is not None:
+                checkpoint.record(filename, pdf_bytes)
+        stats.done += len(members)
+        if on_progress:
+            on_progress(stats)
+        yield filename, pdf_bytes
+
+    if metrics and checkpoint is not None:
+        metrics.count("resumed_pdfs", stats.resumed)
+
+def render_class_sets(records, exam_config, split_by_stream=False, workers=None, on_progress=None, metrics=None,
+                      checkpoint=None):
+    """Render the roster as merged multi-page PDFs, yielding (filename, pdf_bytes).
+
+    Every student's pages are appended to one canvas, so the page layout form,
+    the logo and the fonts are embedded once per file and shared by all pages.
+    With split_by_stream there is one file per stream, in the order the streams
+    first appear in the roster, and the streams are rendered in parallel.
+    Class sets completed in ``checkpoint`` by an interrupted run are reused.
+    """
+    entries = [(filename, 0, members) for filename, members in _class_sets(list(records), split_by_stream)]
+    yield from _render_class_set_entries(entries, [exam_config], workers, on_progress, metrics, checkpoint)
+
+def render_papers(paper_rosters, class_sets=False, split_by_stream=False, workers=None, on_progress=None, metrics=None,
+                  cache=None, checkpoint=None, only=None):
+    """Render several papers for a roster in one run, yielding ("<paper folder>/<file>", pdf_bytes).
+
+    ``paper_rosters`` is a list of (exam_config, records) pairs, one per paper;
+    the records usually only differ in their exam numbers. All papers share one
+    worker pool, so the cores stay busy across paper boundaries, and each worker
+    keeps a template per paper alongside the logo and table caches. With
+    class_sets every paper becomes one merged PDF (or one per stream);
+    otherwise individual PDFs already in ``cache`` are reused. Files completed
+    in ``checkpoint`` by an interrupted run are not rendered again. ``only``
+    picks roster positions for individual PDFs, as in render_batch.
+    """
+    exam_configs = [exam_config for exam_config, _ in paper_rosters]
+    folders = paper_folders(exam_configs)
+    if metrics:
+        metrics.count("papers", len(paper_rosters))
+    if class_sets:
+        entries = [
+            (f"{folder}/{filename}", paper, members)
+            for paper, (folder, (_, records)) in enumerate(zip(folders, paper_rosters))
+            for filename, members in _class_sets(list(records), split_by_stream)
+        ]
+        yield from _render_class_set_entries(entries, exam_configs, workers, on_progress, metrics, checkpoint)
+    else:
+        entries = [
+            (f"{folder}/{filename}", paper, record)
+            for paper, (folder, (_, records)) in enumerate(zip(folders, paper_rosters))
+            for position, (filename, record) in enumerate(
+                zip(unique_filenames(pdf_filename(r.student_name, r.adm_no) for r in records), records))
+            if only is None or position in only
+        ]
+        yield from _render_students(entries, exam_configs, workers, on_progress, metrics, cache, checkpoint)
+
+def write_batch_zip(entries, fileobj=None, metrics=None):
+    """Stream (filename, pdf_bytes) entries straight into a ZIP archive.
+
+    Each PDF is written into its archive entry as soon as it is rendered, so no
+    scratch folder is needed and only one PDF is held at a time. Returns the
+    archive rewound to the start, by default in a SpooledTemporaryFile.
+    """
+    if fileobj is None:
+        fileobj = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_LIMIT)
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as archive:
+        for filename, pdf_bytes in entries:
+            started = time.perf_counter()
+            archive.writestr(filename, pdf_bytes)
+            if metrics:
+                metrics.add_time("archive_write", time.perf_counter() - started)
+                metrics.count("pdf_bytes", len(pdf_bytes))
+    if metrics:
+        metrics.count("archive_bytes", fileobj.tell())
+    try:
+        fileobj.seek(0)
+    except OSError:
+        pass # Streamed straight to a client (see exam_service), nothing to rewind
+    return fileobj
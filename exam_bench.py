@@ -0,0 +1,212 @@
+"""Benchmarks for the rendering pipeline, runnable without Streamlit.
+
+    python -m exam_bench -o bench_results.json
+    python -m exam_bench --sizes 50 --label quick-check
+
+Every scenario runs in a fresh process, so caches start cold and the peak RSS
+belongs to that scenario alone (peak_rss_bytes for the process that drives
+the batch, worker_peak_rss_bytes for its largest render worker). Results are
+written as JSON so runs from different versions can be compared.
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+DEFAULT_SIZES = (50, 500, 5000)
+
+# Scenarios that vary one thing at a time are run on this many students
+DETAIL_STUDENTS = 500
+
+KCSE_STYLE = "K.C.S.E. Standard (Section I, Section II, Grand Total)"
+CUSTOM_STYLE = "Customized Score Sheet"
+
+def synthetic_roster_csv(students):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["Name", "Admission No.", "Stream"])
+    streams = ["EAST", "WEST", "NORTH", "SOUTH"]
+    for i in range(students):
+        writer.writerow([f"Student Number {i:05d}", 10000 + i, streams[i % len(streams)]])
+    return output.getvalue().encode("utf-8")
+
+def synthetic_logo(pixels=2000):
+    """A photo-sized JPEG, like a logo photographed on a phone."""
+    from PIL import Image
+
+    image = Image.radial_gradient("L").resize((pixels, pixels)).convert("RGB")
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=92)
+    return output.getvalue()
+
+def scenario_config(marking_table_style=KCSE_STYLE, section_1_questions=16, section_2_questions=8,
+                    custom_rows=None, logo=False, instructions=None):
+    from exam_render import DEFAULT_INSTRUCTIONS, DEFAULT_CUSTOM_TABLE_ROWS
+
+    return dict(
+        form="Form 4", subject="MATHEMATICS", term="Term 2", exam_name="End of Term Exam",
+        exam_date="04 May 2026", duration="2 HOURS", logo_image=synthetic_logo() if logo else None,
+        raw_instructions=instructions or DEFAULT_INSTRUCTIONS, marking_table_style=marking_table_style,
+        include_exam_number=True, school_name="ST. JOSEPH'S BOYS - KITALE", paper_code="121/1",
+        total_pages_count=1, table_scale=1.1, section_1_questions=section_1_questions,
+        section_2_questions=section_2_questions, section_1_title="SECTION I", section_2_title="SECTION II",
+        include_grand_total=True, custom_table_df=custom_rows or DEFAULT_CUSTOM_TABLE_ROWS,
+        prefill_student_details=True,
+    )
+
+def build_scenarios(sizes):
+    long_instructions = [
+        f"{i}. Candidates must read this instruction carefully and follow it exactly as written for question {i}."
+        for i in range(1, 41)
+    ]
+    many_custom_rows = [{"Section": "A", "Question": str(i), "Maximum Score": 2} for i in range(1, 25)]
+    many_custom_rows.append({"Section": "TOTAL SCORE", "Question": "", "Maximum Score": 48})
+
+    scenarios = [dict(name=f"roster_to_zip_{n}", students=n, mode="zip", config={}) for n in sizes]
+    scenarios += [
+        dict(name=f"kcse_{s1}x{s2}", students=DETAIL_STUDENTS, mode="zip",
+             config=dict(section_1_questions=s1, section_2_questions=s2))
+        for s1, s2 in ((4, 2), (16, 8), (24, 12))
+    ]
+    scenarios += [
+        dict(name="custom_table_25_rows", students=DETAIL_STUDENTS, mode="zip",
+             config=dict(marking_table_style=CUSTOM_STYLE, custom_rows=many_custom_rows)),
+        dict(name="no_logo", students=DETAIL_STUDENTS, mode="zip", config=dict(logo=False)),
+        dict(name="photo_logo", students=DETAIL_STUDENTS, mode="zip", config=dict(logo=True)),
+        dict(name="instructions_overflow_page_2", students=DETAIL_STUDENTS, mode="zip",
+             config=dict(instructions=long_instructions)),
+        dict(name="class_set_pdf", students=DETAIL_STUDENTS, mode="class_set", config=dict(logo=True)),
+        dict(name="generate_exam_pdf_uncached", students=50, mode="single", config={}),
+        dict(name="twelve_papers", students=DETAIL_STUDENTS, mode="papers", config={}),
+    ]
+    return scenarios
+
+def run_scenario(scenario, workers):
+    """Run one scenario in the current process and return its measurements."""
+    from exam_roster import load_roster
+    from exam_batch import render_batch, render_class_sets, render_papers, write_batch_zip
+    from exam_render import ExamPageTemplate, generate_exam_pdf
+
+    exam_config = scenario_config(**scenario["config"])
+    # An end-of-term run: the same roster for a dozen papers with different tables
+    paper_configs = [
+        dict(exam_config, subject=f"PAPER {i}", paper_code=f"{101 + i}/1", section_1_questions=4 + 2 * i)
+        for i in range(12)
+    ] if scenario["mode"] == "papers" else [exam_config]
+    roster_bytes = synthetic_roster_csv(scenario["students"])
+
+    started = time.perf_counter()
+    records = load_roster(io.BytesIO(roster_bytes), "roster.csv")
+    pdf_bytes = 0
+    pdf_count = 0
+    if scenario["mode"] == "single":
+        for record in records:
+            pdf = generate_exam_pdf(record.student_name, record.adm_no, record.stream, **exam_config).getvalue()
+            pdf_bytes += len(pdf)
+            pdf_count += 1
+        output_bytes = pdf_bytes
+    else:
+        if scenario["mode"] == "papers":
+            pdf_files = render_papers([(paper_config, records) for paper_config in paper_configs], workers=workers)
+        elif scenario["mode"] == "class_set":
+            pdf_files = render_class_sets(records, exam_config, workers=workers)
+        else:
+            pdf_files = render_batch(records, exam_config, workers=workers)
+
+        def counted(entries):
+            nonlocal pdf_bytes, pdf_count
+            for filename, data in entries:
+                pdf_bytes += len(data)
+                pdf_count += 1
+                yield filename, data
+
+        with write_batch_zip(counted(pdf_files)) as archive:
+            archive.seek(0, io.SEEK_END)
+            output_bytes = archive.tell()
+    elapsed = time.perf_counter() - started
+
+    # Every student gets the same number of pages, so count them once outside the timed run
+    pages = len(records) * sum(len(ExamPageTemplate(**paper_config).pages) for paper_config in paper_configs)
+
+    return dict(
+        name=scenario["name"],
+        mode=scenario["mode"],
+        students=len(records),
+        pages=pages,
+        seconds=round(elapsed, 4),
+        pages_per_second=round(pages / elapsed, 2) if elapsed else None,
+        bytes_per_pdf=round(pdf_bytes / pdf_count) if pdf_count else None,
+        output_bytes=output_bytes,
+        peak_rss_bytes=peak_rss_bytes(),
+        # The largest render worker, once its pool has shut down; None when the run used no worker processes
+        worker_peak_rss_bytes=peak_rss_bytes(children=True) or None,
+    )
+
+def peak_rss_bytes(children=False):
+    """Peak resident memory of this process, or with ``children`` of the largest finished child process."""
+    try:
+        import resource
+    except ImportError: # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # Linux reports kilobytes
+
+def _run_isolated(scenario, workers):
+    # ProcessPoolExecutor rather than multiprocessing.Pool: its process may start batch workers of its own
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_scenario, scenario, workers).result()
+
+def git_revision():
+    try:
+        # Asked in this file's folder, so running the benchmark from elsewhere still records the revision
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m exam_bench", description="Benchmark the exam page rendering pipeline.")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="JSON file to write the results to")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Comma-separated roster sizes for the end-to-end runs")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes per batch (default: 1, for comparable numbers)")
+    parser.add_argument("--only", help="Only run scenarios whose name contains this text")
+    parser.add_argument("--label", help="Free-form label stored with the results, e.g. a branch name")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    scenarios = [s for s in build_scenarios(sizes) if not args.only or args.only in s["name"]]
+
+    results = []
+    for scenario in scenarios:
+        result = _run_isolated(scenario, args.workers)
+        results.append(result)
+        peak, worker_peak = (f"{result[field] / 2**20:.0f} MB" if result[field] else "n/a"
+                             for field in ("peak_rss_bytes", "worker_peak_rss_bytes"))
+        print(f"{result['name']:<32} {result['pages_per_second']:>9.1f} pages/s "
+              f"{result['bytes_per_pdf']:>10} B/pdf  peak RSS {peak} (worker {worker_peak})", file=sys.stderr)
+
+    report = dict(
+        label=args.label,
+        revision=git_revision(),
+        created=datetime.now().isoformat(timespec="seconds"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        workers=args.workers,
+        scenarios=results,
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
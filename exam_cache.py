@@ -0,0 +1,144 @@
+import os
+import pickle
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from exam_render import custom_table_records
+
+# Part of every cache key: bump it whenever a rendering change alters the PDFs, so old entries stop matching
+CACHE_FORMAT = 1
+
+# Where rendered PDFs are kept between runs (override with EXAM_PDF_CACHE), and how big the cache may grow
+DEFAULT_CACHE_DIR = os.environ.get("EXAM_PDF_CACHE", ".exam_pdf_cache")
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Bytes on disk per cache directory, shared by every PdfCache in this process so that
+# opening one (e.g. for each download click) does not stat the whole directory again
+_directory_sizes = {}
+_directory_sizes_lock = threading.Lock()
+
+@contextmanager
+def atomic_write(path):
+    """Open ``path`` for writing in binary mode, so that it only appears once it is complete.
+
+    The data goes to a temporary file next to ``path`` that replaces it at the
+    end of the block; if the block fails or is interrupted, the temporary file
+    is deleted and ``path`` is left as it was.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def config_fingerprint(exam_config):
+    """Hash of everything in an exam config (ExamPageTemplate keyword arguments) that shows on the page."""
+    settings = dict(exam_config, custom_table_df=custom_table_records(exam_config["custom_table_df"]))
+    if settings["logo_image"]:
+        settings["logo_image"] = hashlib.sha256(settings["logo_image"]).hexdigest()
+    return hashlib.sha256(pickle.dumps((CACHE_FORMAT, sorted(settings.items())))).hexdigest()
+
+def student_cache_key(config_digest, exam_config, record):
+    """Cache key for one student's PDF, or None when the page would get a random exam number."""
+    if exam_config["include_exam_number"] and record.exam_number is None:
+        return None
+    return hashlib.sha256(pickle.dumps((config_digest, tuple(record)))).hexdigest()
+
+class PdfCache:
+    """Rendered PDFs on disk, addressed by a hash of everything that went into them.
+
+    Once the files add up to more than ``max_bytes`` the least recently used
+    ones are deleted (a hit refreshes the file's modification time). The
+    directory is only scanned for its size the first time this process writes
+    to it, and again whenever entries are evicted. Hits, misses and evictions
+    are counted per instance for reporting.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size_key = os.path.abspath(directory)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pdf")
+
+    def _entries(self):
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".pdf"):
+                    stat = entry.stat()
+                    yield stat.st_mtime, entry.path, stat.st_size
+
+    def has(self, key):
+        """Look a key up (counting a hit or a miss) and mark it as recently used."""
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def get(self, key):
+        """The cached PDF bytes, or None if the entry is gone (e.g. evicted by another run)."""
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, pdf_bytes):
+        path = self._path(key)
+        if os.path.exists(path):
+            return # Same key, same content
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written atomically so that a concurrent reader never sees half a PDF
+        with atomic_write(path) as f:
+            f.write(pdf_bytes)
+        with _directory_sizes_lock:
+            size = self._size_on_disk() + len(pdf_bytes)
+            _directory_sizes[self._size_key] = size
+            if size > self.max_bytes:
+                self._evict()
+
+    def _size_on_disk(self):
+        # Call with _directory_sizes_lock held
+        if self._size_key not in _directory_sizes:
+            _directory_sizes[self._size_key] = sum(size for _, _, size in self._entries())
+        return _directory_sizes[self._size_key]
+
+    def _evict(self):
+        # Call with _directory_sizes_lock held. The scan also corrects the size for
+        # files other processes have added or removed since it was last counted.
+        entries = sorted(self._entries())
+        size = sum(size for _, _, size in entries)
+        # Trim to 90% of the limit so that a full cache is not rescanned on every write
+        target = self.max_bytes * 0.9
+        for _, path, entry_size in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            size -= entry_size
+            self.evictions += 1
+        _directory_sizes[self._size_key] = size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with _directory_sizes_lock:
+            size = self._size_on_disk()
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, bytes=size,
+                    hit_rate=round(self.hits / lookups, 4) if lookups else None)
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+
+from exam_batch import write_batch_zip
+from exam_cache import atomic_write
+
+# Where interrupted and finished runs are kept (override with EXAM_CHECKPOINT_DIR)
+DEFAULT_CHECKPOINT_DIR = os.environ.get("EXAM_CHECKPOINT_DIR", ".exam_runs")
+
+# Runs that nobody has resumed or downloaded for this long are deleted when the next run starts
+CHECKPOINT_RETENTION_SECONDS = 24 * 60 * 60
+
+MANIFEST_NAME = "manifest.jsonl"
+ARCHIVE_NAME = "archive.zip"
+
+def remove_stale_checkpoints(directory=DEFAULT_CHECKPOINT_DIR, max_age=CHECKPOINT_RETENTION_SECONDS):
+    cutoff = time.time() - max_age
+    try:
+        runs = [entry for entry in os.scandir(directory) if entry.is_dir() and entry.stat().st_mtime < cutoff]
+    except FileNotFoundError:
+        return
+    for entry in runs:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+class BatchCheckpoint:
+    """The finished output files of one batch run, kept on disk so that the run can be resumed.
+
+    Every rendered file is saved under ``files/`` and only then appended to a
+    manifest with its SHA-256 hash, so the manifest never lists half a file.
+    A run started again with the same ``run_key`` (a hash of the roster and
+    the settings) skips the files in the manifest whose hash still matches.
+    Once the ZIP archive has been written it replaces the individual files and
+    is handed out again as a whole.
+    """
+
+    def __init__(self, run_key, directory=DEFAULT_CHECKPOINT_DIR):
+        remove_stale_checkpoints(directory)
+        self.path = os.path.join(directory, run_key)
+        self._files = os.path.join(self.path, "files")
+        os.makedirs(self.path, exist_ok=True)
+        os.utime(self.path) # Resuming a run keeps it from being cleaned up
+        manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        self.completed = self._load_manifest(manifest_path)
+        self._manifest = open(manifest_path, "a", encoding="utf-8")
+
+    def _load_manifest(self, manifest_path):
+        completed = {}
+        try:
+            with open(manifest_path, encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return completed
+        for line in text.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # Cut off by a crash while it was being written
+            completed[entry["file"]] = entry["sha256"]
+        if text and not text.endswith("\n"):
+            with open(manifest_path, "a", encoding="utf-8") as f:
+                f.write("\n")
+        return completed
+
+    def close(self):
+        self._manifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.completed
+
+    def _file_path(self, name):
+        return os.path.join(self._files, *name.split("/"))
+
+    @property
+    def finished(self):
+        return os.path.exists(os.path.join(self.path, ARCHIVE_NAME))
+
+    def get(self, name):
+        """The saved bytes of a completed file, or None if the file is missing or does not match its hash."""
+        try:
+            with open(self._file_path(name), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        return data if hashlib.sha256(data).hexdigest() == self.completed.get(name) else None
+
+    def record(self, name, pdf_bytes):
+        """Save a finished file and add it to the manifest."""
+        path = self._file_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as f:
+            f.write(pdf_bytes)
+        digest = hashlib.sha256(pdf_bytes).hexdigest()
+        self._manifest.write(json.dumps({"file": name, "sha256": digest, "bytes": len(pdf_bytes)}) + "\n")
+        # Flushed rather than fsynced: this guards against the app restarting, not the machine losing power
+        self._manifest.flush()
+        self.completed[name] = digest
+
+    def archive(self, entries, metrics=None):
+        """The run's ZIP archive opened for reading, written from ``entries`` unless an earlier run finished it."""
+        path = os.path.join(self.path, ARCHIVE_NAME)
+        if not os.path.exists(path):
+            # Cancelled or failed part-way: the files written so far stay checkpointed, the partial ZIP goes
+            with atomic_write(path) as f:
+                write_batch_zip(entries, f, metrics=metrics)
+            shutil.rmtree(self._files, ignore_errors=True) # All in the archive now
+        return open(path, "rb")
@@ -0,0 +1,137 @@
+"""Generate exam top pages without the Streamlit app.
+
+    python -m exam_cli students.xlsx exam.yaml -o Personalized_Exam_Top_Pages.zip
+
+The exam config is a YAML or JSON file with the same settings as the web form:
+
+    school_name: ST. JOSEPH'S BOYS - KITALE
+    form: Form 4
+    subject: MATHEMATICS
+    term: Term 2
+    exam_name: Paper 1
+    exam_date: 2026-05-04
+    duration: 2 HOURS
+    paper_code: 121/1
+    logo: logo.png
+    marking_table_style: K.C.S.E. Standard (Section I, Section II, Grand Total)
+
+Anything left out falls back to the web form's defaults.
+
+To produce several papers for the same roster in one run, list them under
+``papers`` (or pass a CSV/Excel sheet with one row per paper via --papers);
+each paper's settings override the shared ones above:
+
+    papers:
+      - {subject: MATHEMATICS, paper_code: 121/1}
+      - {subject: ENGLISH, paper_code: 101/1, duration: 1 HOUR 45 MINUTES}
+
+The output is then a ZIP with a folder per paper.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import sqlite3
+
+from exam_manifest import exam_config_from_dict, load_config_file, load_papers, paper_exam_configs
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m exam_cli", description="Generate personalized exam top pages.")
+    parser.add_argument("roster", help="Excel or CSV file with the student list")
+    parser.add_argument("config", help="YAML or JSON file with the exam details")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Where to write the ZIP file, or the PDF with --merged (default: "
+                             "Personalized_Exam_Top_Pages.zip, or .pdf for a single class set)")
+    parser.add_argument("--papers", help="YAML, JSON, CSV or Excel list of papers to generate in one run (see above)")
+    parser.add_argument("--merged", action="store_true", help="Write one merged class-set PDF instead of a ZIP of PDFs")
+    parser.add_argument("--split-by-stream", action="store_true", help="With --merged, write a ZIP with one class set per stream")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all CPU cores)")
+    parser.add_argument("--exam-number-index", default=None,
+                        help="SQLite file that remembers each candidate's exam number (default: exam_numbers.sqlite3, "
+                             "or the EXAM_NUMBER_INDEX environment variable)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Reuse unchanged PDFs from earlier runs kept in this folder (default: .exam_pdf_cache, "
+                             "or the EXAM_PDF_CACHE environment variable)")
+    parser.add_argument("--cache-max-mb", type=int, default=None, help="Size limit of the PDF cache in megabytes (default: 512)")
+    parser.add_argument("--no-cache", action="store_true", help="Render every PDF again instead of reusing cached ones")
+    parser.add_argument("--report", help="Write a JSON report with per-stage timings and counters to this file")
+    parser.add_argument("--profile", help="Write a cProfile dump of the run to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log a JSON line for every finished stage")
+    args = parser.parse_args(argv)
+    if args.split_by_stream and not args.merged:
+        parser.error("--split-by-stream only works with --merged")
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    # Imported after argument parsing so that --help and usage errors return immediately
+    from exam_roster import load_roster, roster_problems
+    from exam_batch import render_batch, render_class_sets, render_papers, write_batch_zip
+    from exam_metrics import RunMetrics, profiled
+    from exam_numbers import number_paper_rosters
+    from exam_cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES, PdfCache
+
+    metrics = RunMetrics()
+    with profiled(args.profile):
+        try:
+            settings = load_config_file(args.config)
+            config_dir = os.path.dirname(os.path.abspath(args.config))
+            exam_config = exam_config_from_dict(settings, config_dir)
+            paper_configs = None
+            if args.papers:
+                paper_configs = paper_exam_configs(exam_config, load_papers(args.papers),
+                                                   os.path.dirname(os.path.abspath(args.papers)))
+            elif settings.get("papers"):
+                paper_configs = paper_exam_configs(exam_config, settings["papers"], config_dir)
+            with metrics.stage("read_roster"):
+                records = load_roster(args.roster)
+            for problem in roster_problems(records):
+                print(f"warning: {problem}", file=sys.stderr)
+            with metrics.stage("exam_numbers"):
+                paper_rosters = number_paper_rosters(records, paper_configs or [exam_config], args.exam_number_index)
+        except (OSError, ValueError, ImportError, sqlite3.Error) as e:
+            parser.exit(2, f"error: {e}\n")
+
+        single_pdf = args.merged and not args.split_by_stream and not paper_configs
+        if args.output is None:
+            args.output = "Personalized_Exam_Top_Pages.pdf" if single_pdf else "Personalized_Exam_Top_Pages.zip"
+
+        # Only individual PDFs are cached; a class set changes whenever any student in it does
+        cache = None
+        if not args.merged and not args.no_cache:
+            cache = PdfCache(args.cache_dir or DEFAULT_CACHE_DIR,
+                             args.cache_max_mb * 1024 * 1024 if args.cache_max_mb else DEFAULT_CACHE_MAX_BYTES)
+
+        if paper_configs:
+            pdf_files = render_papers(paper_rosters, class_sets=args.merged, split_by_stream=args.split_by_stream,
+                                      workers=args.workers, metrics=metrics, cache=cache)
+        elif args.merged:
+            pdf_files = render_class_sets(paper_rosters[0][1], exam_config, split_by_stream=args.split_by_stream,
+                                          workers=args.workers, metrics=metrics)
+        else:
+            pdf_files = render_batch(paper_rosters[0][1], exam_config, workers=args.workers, metrics=metrics, cache=cache)
+
+        with open(args.output, "wb") as output:
+            if single_pdf:
+                for _, pdf_bytes in pdf_files:
+                    output.write(pdf_bytes)
+                    metrics.count("pdf_bytes", len(pdf_bytes))
+            else:
+                write_batch_zip(pdf_files, output, metrics=metrics)
+
+    report = metrics.log_report()
+    if cache is not None:
+        report["cache"] = cache.stats()
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    papers = f" x {len(paper_configs)} papers" if paper_configs else ""
+    print(f"Wrote {len(records)} students{papers} to {args.output} in {report['total_seconds']:.1f} seconds "
+          f"(p50 {report['page_render_ms_p50']} ms, p95 {report['page_render_ms_p95']} ms per page)", file=sys.stderr)
+    if cache is not None:
+        print(f"PDF cache: {cache.hits} reused, {cache.misses} rendered, {cache.evictions} evicted", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
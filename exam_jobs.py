@@ -0,0 +1,158 @@
+import os
+import time
+import uuid
+import logging
+import itertools
+import tempfile
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Worker processes that all running jobs together may use; jobs that don't fit wait in the queue
+MAX_WORKER_PROCESSES = os.cpu_count() or 1
+
+# Finished jobs are kept this long so a reopened page can still pick up the download
+JOB_RETENTION_SECONDS = 60 * 60
+
+class JobCancelled(Exception):
+    """Raised inside a job when the user has asked for it to stop."""
+
+class GenerationJob:
+    """A generation run executing in the background, polled by the UI.
+
+    ``workers`` is how many worker processes the job asked for; once it starts,
+    ``granted_workers`` is how many it may actually use, and ``workspace`` is
+    a temporary directory of its own that is deleted when it finishes.
+    """
+
+    def __init__(self, work, total, key=None, owner=None, workers=1):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.owner = owner
+        self.total = total
+        self.workers = max(1, min(workers, MAX_WORKER_PROCESSES))
+        self.granted_workers = None
+        self.workspace = None
+        self.done = 0
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._work = work
+        self._order = next(_submission_order)
+        self._cancel_requested = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    @property
+    def queue_position(self):
+        """1 for the next job to start, 2 for the one after that, ...; None once the job has started."""
+        with _jobs_lock:
+            queued = _fair_order()
+        return queued.index(self) + 1 if self in queued else None
+
+    @property
+    def eta_seconds(self):
+        if not self.started or not self.done or self.done >= self.total:
+            return None
+        elapsed = time.time() - self.started
+        return elapsed / self.done * (self.total - self.done)
+
+    def cancel(self):
+        self._cancel_requested.set()
+        with _jobs_lock:
+            if self in _queue: # Never started, so there is nothing to stop
+                _queue.remove(self)
+                self.status = "cancelled"
+                self.finished = time.time()
+
+    def check_cancelled(self):
+        """Call between units of work; raises JobCancelled once cancel() has been requested."""
+        if self._cancel_requested.is_set():
+            raise JobCancelled()
+
+    def report_progress(self, done):
+        self.done = done
+        self.check_cancelled()
+
+_submission_order = itertools.count()
+_jobs = {}
+_queue = [] # Waiting jobs, in the order they were submitted
+_free_workers = MAX_WORKER_PROCESSES
+_jobs_lock = threading.Lock()
+
+def _fair_order():
+    # Round robin over owners: an owner's n-th waiting job goes behind every other
+    # owner's earlier ones, counting the jobs the owner has had started recently
+    started = Counter(job.owner for job in _jobs.values() if job.granted_workers is not None)
+    waiting = Counter()
+    ranked = []
+    for job in _queue:
+        ranked.append((started[job.owner] + waiting[job.owner], job._order, job))
+        waiting[job.owner] += 1
+    return [job for _, _, job in sorted(ranked, key=lambda item: item[:2])]
+
+def _start_queued_jobs():
+    global _free_workers
+    while _queue and _free_workers > 0:
+        job = _fair_order()[0]
+        _queue.remove(job)
+        # Start with the workers that are free rather than wait for all of them
+        job.granted_workers = min(job.workers, _free_workers)
+        _free_workers -= job.granted_workers
+        threading.Thread(target=_run, args=(job,), name=f"exam-job-{job.id}", daemon=True).start()
+
+def _run(job):
+    global _free_workers
+    job.status = "running"
+    job.started = time.time()
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"exam-job-{job.id}-") as workspace:
+            job.workspace = workspace
+            job.check_cancelled() # Cancelled just as it was being started
+            job.result = job._work(job)
+        job.status = "done"
+    except JobCancelled:
+        job.status = "cancelled"
+    except Exception as e:
+        logger.exception("Generation job %s failed", job.id)
+        job.error = str(e)
+        job.status = "failed"
+    finally:
+        job.workspace = None
+        job.finished = time.time()
+        with _jobs_lock:
+            _free_workers += job.granted_workers
+            _start_queued_jobs()
+
+def submit_job(work, total, key=None, owner=None, workers=1):
+    """Queue ``work(job)`` to run in the background and return the job straight away.
+
+    Jobs start as soon as worker processes are free, and several owners (e.g.
+    browser sessions) take turns rather than queueing behind each other's jobs.
+    ``work`` renders with job.granted_workers processes, keeps scratch files in
+    job.workspace and reports progress with job.report_progress(done), which
+    also raises JobCancelled once the job is cancelled; its return value
+    becomes job.result.
+    """
+    job = GenerationJob(work, total, key, owner, workers)
+    with _jobs_lock:
+        _forget_old_jobs()
+        _jobs[job.id] = job
+        _queue.append(job)
+        _start_queued_jobs()
+    return job
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def _forget_old_jobs():
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    for job_id in [job_id for job_id, job in _jobs.items() if job.finished and job.finished < cutoff]:
+        del _jobs[job_id]
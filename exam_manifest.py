@@ -0,0 +1,144 @@
+import os
+import json
+from contextlib import closing
+from datetime import date, datetime
+
+from exam_render import (
+    DEFAULT_INSTRUCTIONS, DEFAULT_SECTION_1_QNS, DEFAULT_SECTION_2_QNS, DEFAULT_SECTION_1_TITLE,
+    DEFAULT_SECTION_2_TITLE, DEFAULT_INCLUDE_GRAND_TOTAL, DEFAULT_TABLE_SCALE, DEFAULT_CUSTOM_TABLE_ROWS,
+    MARKING_TABLE_STYLES, prepare_logo,
+)
+
+# Config file keys that differ from the ExamPageTemplate keyword argument they set
+RENAMED_SETTINGS = {"instructions": "raw_instructions", "logo": "logo_image", "custom_table": "custom_table_df"}
+
+def default_exam_config():
+    """ExamPageTemplate keyword arguments with the web form's defaults."""
+    return dict(
+        form="Form 1",
+        subject="",
+        term="",
+        exam_name="",
+        exam_date=datetime.now().strftime("%d %B %Y"),
+        duration="2 HOURS",
+        logo_image=None,
+        raw_instructions=DEFAULT_INSTRUCTIONS,
+        marking_table_style=MARKING_TABLE_STYLES[0],
+        include_exam_number=True,
+        school_name="",
+        paper_code="",
+        total_pages_count=1,
+        table_scale=DEFAULT_TABLE_SCALE,
+        section_1_questions=DEFAULT_SECTION_1_QNS,
+        section_2_questions=DEFAULT_SECTION_2_QNS,
+        section_1_title=DEFAULT_SECTION_1_TITLE,
+        section_2_title=DEFAULT_SECTION_2_TITLE,
+        include_grand_total=DEFAULT_INCLUDE_GRAND_TOTAL,
+        custom_table_df=DEFAULT_CUSTOM_TABLE_ROWS,
+        prefill_student_details=True,
+    )
+
+def _parse_config(text, filename):
+    if filename.lower().endswith((".yaml", ".yml")):
+        import yaml # Only needed for YAML configs
+        return yaml.safe_load(text) or {}
+    return json.loads(text)
+
+def load_config_file(path):
+    with open(path, encoding="utf-8") as f:
+        return _parse_config(f.read(), path)
+
+def _coerce(value, current):
+    # Spreadsheet cells arrive as text; match the type of the value being replaced
+    if not isinstance(value, str):
+        # YAML reads "form: 4" or "subject: 2020" as numbers, which the page cannot draw
+        if isinstance(current, str):
+            return "" if value is None else str(value)
+        return value
+    if isinstance(current, bool):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    if isinstance(current, int):
+        return int(float(value))
+    if isinstance(current, float):
+        return float(value)
+    if isinstance(current, list):
+        return [line.strip() for line in value.splitlines() if line.strip()]
+    return value
+
+def exam_config_from_dict(settings, base_dir=".", base_config=None, allow_logo_path=True):
+    """Turn a loaded config file into ExamPageTemplate keyword arguments.
+
+    Settings that are left out keep their value from ``base_config`` (another
+    exam config), or fall back to the web form's defaults. A ``logo`` is a path
+    relative to ``base_dir``; settings that come from someone else (such as an
+    uploaded paper list) must be read with allow_logo_path=False, so they
+    cannot make the server open its own files.
+    """
+    exam_config = dict(base_config or default_exam_config())
+    for key, value in settings.items():
+        name = RENAMED_SETTINGS.get(key, key)
+        # Text would be split into a list of strings, which the table renderer cannot use
+        if name == "custom_table_df" and value is not None and (
+                not isinstance(value, list) or not all(isinstance(row, dict) for row in value)):
+            raise ValueError("custom_table must be a list of rows, each with Section, Question and Maximum Score")
+        if name in exam_config and name != "logo_image":
+            exam_config[name] = _coerce(value, exam_config[name])
+
+    if not isinstance(exam_config["raw_instructions"], (list, tuple)) or not all(
+            isinstance(line, str) for line in exam_config["raw_instructions"]):
+        raise ValueError("instructions must be a list of lines of text")
+
+    if settings.get("logo"):
+        if not allow_logo_path:
+            raise ValueError("a logo cannot be set here; upload the logo on the page instead")
+        exam_config["logo_image"] = prepare_logo(os.path.join(base_dir, settings["logo"]))
+
+    if isinstance(exam_config["exam_date"], date):
+        exam_config["exam_date"] = exam_config["exam_date"].strftime("%d %B %Y")
+    exam_config["exam_date"] = str(exam_config["exam_date"])
+    exam_config["paper_code"] = str(exam_config["paper_code"])
+
+    if exam_config["marking_table_style"] not in MARKING_TABLE_STYLES:
+        raise ValueError(f"marking_table_style must be one of: {', '.join(MARKING_TABLE_STYLES)}")
+    return exam_config
+
+def _sheet_papers(papers_file, filename):
+    from exam_roster import is_blank_row, iter_sheet_rows
+
+    rows = iter_sheet_rows(papers_file, filename)
+    with closing(rows):
+        header = next(rows, None) or ()
+        # "Paper Code" in a sheet is the paper_code setting
+        columns = ["_".join(str(col).strip().lower().split()) if col is not None else "" for col in header]
+        return [
+            {column: value for column, value in zip(columns, row) if column and value is not None and str(value).strip() != ""}
+            for row in rows if not is_blank_row(row)
+        ]
+
+def load_papers(papers_file, filename=None):
+    """Read the list of papers for a multi-exam run, as a list of settings dicts.
+
+    Either a YAML/JSON file (a list of papers, or a mapping with a ``papers``
+    list) or a CSV/Excel sheet with one row per paper and the config file keys
+    as column headers (subject, paper_code, duration, marking_table_style, ...).
+    ``papers_file`` is a path or a file-like object such as a Streamlit upload.
+    """
+    filename = filename or getattr(papers_file, "name", papers_file)
+    if filename.lower().endswith((".yaml", ".yml", ".json")):
+        if isinstance(papers_file, str):
+            settings = load_config_file(papers_file)
+        else:
+            papers_file.seek(0)
+            settings = _parse_config(papers_file.read().decode("utf-8-sig"), filename)
+        papers = settings.get("papers", []) if isinstance(settings, dict) else settings
+    else:
+        papers = _sheet_papers(papers_file, filename)
+
+    if not papers or not all(isinstance(paper, dict) for paper in papers):
+        raise ValueError("The paper list needs at least one paper, each with its own settings.")
+    return papers
+
+def paper_exam_configs(exam_config, papers, base_dir=".", allow_logo_path=True):
+    """One exam config per paper: ``exam_config`` with that paper's settings applied on top."""
+    return [exam_config_from_dict(paper, base_dir, base_config=exam_config, allow_logo_path=allow_logo_path)
+            for paper in papers]
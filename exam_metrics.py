@@ -0,0 +1,87 @@
+import json
+import time
+import logging
+import cProfile
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class RunMetrics:
+    """Timers and counters for one generation run.
+
+    Stage timers add up wall-clock seconds per named stage (roster parsing,
+    rendering, archive writes, ...). Page render times come from the process
+    that actually drew the page, so they stay meaningful with a worker pool.
+    Every finished stage is logged as a JSON line on the ``exam_metrics`` logger.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.page_seconds = []
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.add_time(name, seconds)
+            logger.info(json.dumps({"event": "stage", "stage": name, "seconds": round(seconds, 4)}))
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_render(self, seconds, pages):
+        """Record one rendered PDF that took ``seconds`` for ``pages`` pages."""
+        self.count("pdfs")
+        self.count("pages", pages)
+        if pages:
+            self.page_seconds.extend([seconds / pages] * pages)
+
+    def page_percentile(self, fraction):
+        """Nearest-rank percentile of the per-page render time, in seconds."""
+        if not self.page_seconds:
+            return None
+        ordered = sorted(self.page_seconds)
+        return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+    def report(self):
+        def milliseconds(seconds):
+            return round(seconds * 1000, 3) if seconds is not None else None
+
+        return {
+            "total_seconds": round(time.perf_counter() - self.started, 4),
+            "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+            "page_render_ms_p50": milliseconds(self.page_percentile(0.50)),
+            "page_render_ms_p95": milliseconds(self.page_percentile(0.95)),
+        }
+
+    def log_report(self):
+        report = self.report()
+        logger.info(json.dumps({"event": "run", **report}))
+        return report
+
+@contextmanager
+def profiled(path=None):
+    """Run the block under cProfile and dump the stats to ``path``; does nothing when path is None.
+
+    Only the current process is profiled, so with a worker pool the rendering
+    itself shows up as time spent waiting on the workers.
+    """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
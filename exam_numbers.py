@@ -0,0 +1,137 @@
+import os
+import string
+import secrets
+import sqlite3
+import threading
+
+from exam_roster import MISSING_ADM_NO
+
+# Where allocated exam numbers are remembered between runs (override with EXAM_NUMBER_INDEX)
+DEFAULT_INDEX_PATH = os.environ.get("EXAM_NUMBER_INDEX", "exam_numbers.sqlite3")
+
+# Same shape as the random numbers from exam_render.generate_exam_number
+EXAM_NUMBER_LENGTH = 10
+EXAM_NUMBER_ALPHABET = string.ascii_uppercase + string.digits
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS exam_numbers (
+    school TEXT NOT NULL,
+    exam TEXT NOT NULL,
+    adm_no TEXT NOT NULL,
+    exam_number TEXT NOT NULL UNIQUE,
+    allocated TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (school, exam, adm_no)
+) WITHOUT ROWID;
+"""
+
+def _normalise(value):
+    return " ".join(str(value).split()).upper()
+
+def exam_key(exam_config):
+    """Identify one paper of one exam sitting from ExamPageTemplate keyword arguments.
+
+    A candidate keeps their exam number whenever the same paper is regenerated,
+    even if the date, instructions or layout change in between.
+    """
+    return "|".join(_normalise(exam_config.get(name, "")) for name in ("form", "term", "exam_name", "subject", "paper_code"))
+
+def new_exam_number():
+    """A fresh random exam number. It must not be derivable from the candidate, or it would not keep them anonymous."""
+    return "".join(secrets.choice(EXAM_NUMBER_ALPHABET) for _ in range(EXAM_NUMBER_LENGTH))
+
+class ExamNumberIndex:
+    """Exam numbers per (school, exam, admission number), kept in a local SQLite file.
+
+    Numbers are random and unique across everything in the index, and a
+    candidate who is regenerated for the same exam gets the number they were
+    given the first time. Both directions (candidate to number and number to candidate) are
+    primary-key lookups, for reconciling marks later.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit mode, so allocate() can take the write lock up front with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def allocate(self, school, exam, adm_nos):
+        """Return {adm_no: exam_number} for every admission number, allocating the missing ones.
+
+        All new numbers for the roster are checked and written in a single
+        transaction, which also keeps concurrent runs from handing out the
+        same number twice.
+        """
+        school, exam = _normalise(school), _normalise(exam)
+        adm_nos = list(dict.fromkeys(str(adm_no) for adm_no in adm_nos))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                numbers = dict(self._conn.execute(
+                    "SELECT adm_no, exam_number FROM exam_numbers WHERE school = ? AND exam = ?", (school, exam)))
+                for adm_no in adm_nos:
+                    if adm_no in numbers:
+                        continue
+                    while True:
+                        number = new_exam_number()
+                        try:
+                            self._conn.execute("INSERT INTO exam_numbers (school, exam, adm_no, exam_number) "
+                                               "VALUES (?, ?, ?, ?)", (school, exam, adm_no, number))
+                        except sqlite3.IntegrityError:
+                            continue # Number already given to someone else; only that statement is undone
+                        break
+                    numbers[adm_no] = number
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return {adm_no: numbers[adm_no] for adm_no in adm_nos}
+
+    def lookup(self, school, exam, adm_no):
+        """The exam number already allocated to a candidate, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT exam_number FROM exam_numbers WHERE school = ? AND exam = ? AND adm_no = ?",
+                (_normalise(school), _normalise(exam), str(adm_no))).fetchone()
+        return row[0] if row else None
+
+    def candidate(self, exam_number):
+        """(school, exam, adm_no) for an exam number, or None if it was never allocated."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT school, exam, adm_no FROM exam_numbers WHERE exam_number = ?",
+                (exam_number.strip().upper(),)).fetchone()
+        return tuple(row) if row else None
+
+def assign_exam_numbers(records, exam_config, index):
+    """Return the roster records with their exam numbers filled in from ``index``."""
+    records = list(records)
+    # Rows without an admission number cannot be told apart, so they keep random numbers
+    numbers = index.allocate(exam_config.get("school_name", ""), exam_key(exam_config),
+                             [record.adm_no for record in records if record.adm_no != MISSING_ADM_NO])
+    return [record._replace(exam_number=numbers.get(record.adm_no)) for record in records]
+
+def number_paper_rosters(records, exam_configs, index_path=None):
+    """Pair every exam config with the roster, exam numbers filled in for the papers that print them.
+
+    Numbers are allocated per paper, so each such paper gets its own copy of
+    the records; the index is only opened when at least one paper needs it.
+    """
+    records = list(records)
+    if not any(exam_config["include_exam_number"] for exam_config in exam_configs):
+        return [(exam_config, records) for exam_config in exam_configs]
+    with ExamNumberIndex(index_path or DEFAULT_INDEX_PATH) as index:
+        return [
+            (exam_config, assign_exam_numbers(records, exam_config, index) if exam_config["include_exam_number"] else records)
+            for exam_config in exam_configs
+        ]
@@ -0,0 +1,41 @@
+from exam_render import generate_exam_pdf
+from exam_roster import MISSING_ADM_NO, StudentRecord
+from exam_numbers import DEFAULT_INDEX_PATH, ExamNumberIndex, exam_key
+
+# Shown when no roster has been uploaded yet
+SAMPLE_STUDENT = StudentRecord("JANE WANJIKU", "1234", "EAST")
+
+# 1.5 x 72 dpi: sharp enough on screen, and quick to rasterise on every slider move
+PREVIEW_ZOOM = 1.5
+
+def preview_student(records=None, exam_config=None, index_path=None):
+    """The student a preview is drawn for: the first roster row, or a sample student.
+
+    With an ``exam_config`` that prints exam numbers, the roster row carries the
+    number the exam number index already holds for that student. Nothing is
+    allocated here, so editing the settings does not fill the index with
+    numbers for exams that are never generated.
+    """
+    if not records:
+        return SAMPLE_STUDENT
+    record = records[0]
+    if exam_config and exam_config["include_exam_number"] and record.adm_no != MISSING_ADM_NO:
+        with ExamNumberIndex(index_path or DEFAULT_INDEX_PATH) as index:
+            record = record._replace(exam_number=index.lookup(exam_config.get("school_name", ""), exam_key(exam_config),
+                                                              record.adm_no))
+    return record
+
+def preview_pdf(exam_config, record=SAMPLE_STUDENT):
+    """One student's page (as PDF bytes) for an exam config, drawn as the batch would draw it.
+
+    A record without an exam number gets a random one, as in generate_exam_pdf.
+    """
+    return generate_exam_pdf(record.student_name, record.adm_no, record.stream, exam_number=record.exam_number,
+                             **exam_config)
+
+def pdf_page_images(pdf_bytes, zoom=PREVIEW_ZOOM):
+    """PNG bytes for every page of a PDF. Needs PyMuPDF (``pip install pymupdf``)."""
+    import pymupdf # Only needed for previews
+
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as document:
+        return [page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom)).tobytes("png") for page in document]
@@ -0,0 +1,619 @@
+import hashlib
+import logging
+import random
+import string
+import functools
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import Table, TableStyle, Paragraph
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+# Rendering core shared by the Streamlit app, the batch engine and the command line.
+# It must stay importable without Streamlit, and pandas/Pillow are only loaded when needed.
+
+logger = logging.getLogger(__name__)
+
+# === Config ===
+EXAM_HEADER = "Kenya Certificate of Secondary Examinations"
+
+DEFAULT_INSTRUCTIONS = [
+    "1. Write your name and index number in the spaces provided above.",
+    "2. Sign and write the date of examination in the spaces provided.",
+    "3. This paper consists of TWO sections: Section I and Section II.",
+    "4. Answer ALL the questions in Section I and only Five from Section II.",
+    "5. All answers and working must be written on the question paper in the spaces provided below each question.",
+    "6. Show all the steps in your calculations, giving answers at each stage in the spaces provided below each question.",
+    "7. Candidates should answer all questions in English.",
+    "8. Candidates should check to ascertain that all pages are printed as indicated and that no questions are missing."
+]
+
+# Default values for the new table customization
+DEFAULT_SECTION_1_QNS = 16
+DEFAULT_SECTION_2_QNS = 8
+DEFAULT_SECTION_1_TITLE = "SECTION I"
+DEFAULT_SECTION_2_TITLE = "SECTION II"
+DEFAULT_INCLUDE_GRAND_TOTAL = True
+
+# Default scale for the new complex table - Increased slightly for better default width
+DEFAULT_TABLE_SCALE = 1.1 # 1.0 means original size, 1.1 means 10% larger, 0.9 means 10% smaller
+
+MARKING_TABLE_STYLES = (
+    "K.C.S.E. Standard (Section I, Section II, Grand Total)",
+    "Customized Score Sheet",
+    "None",
+)
+
+# Default rows for the custom marking table
+DEFAULT_CUSTOM_TABLE_ROWS = [
+    {"Section": "A", "Question": "1 - 11", "Maximum Score": 25},
+    {"Section": "B", "Question": "12", "Maximum Score": 11},
+    {"Section": "B", "Question": "13", "Maximum Score": 11},
+    {"Section": "B", "Question": "14", "Maximum Score": 11},
+    {"Section": "B", "Question": "15", "Maximum Score": 10},
+    {"Section": "B", "Question": "16", "Maximum Score": 12},
+    {"Section": "TOTAL SCORE", "Question": "", "Maximum Score": 80},
+]
+
+def __getattr__(name):
+    # DEFAULT_CUSTOM_TABLE_DATA is a DataFrame for the Streamlit data editor; build it on first
+    # use so that importing this module does not pay for pandas
+    if name == "DEFAULT_CUSTOM_TABLE_DATA":
+        import pandas as pd
+        return pd.DataFrame(DEFAULT_CUSTOM_TABLE_ROWS)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# The logo is drawn in a 60 x 60 point box; anything above print resolution is wasted
+LOGO_SIZE_POINTS = 60
+LOGO_PRINT_DPI = 300
+LOGO_CACHE_SIZE = 16
+
+# Prepared logos keyed on (content hash, dpi), shared by every batch and rerun in this process
+_prepared_logos = OrderedDict()
+_prepared_logos_lock = threading.Lock() # Script threads and service request threads share the cache
+
+def prepare_logo(logo_image, dpi=LOGO_PRINT_DPI):
+    """Return the logo as compact image bytes sized for printing at ``dpi``.
+
+    Accepts raw bytes, a file-like object (such as a Streamlit upload) or a path.
+    The image is decoded once, scaled down to fit the logo box at print
+    resolution and re-encoded (JPEG for opaque images, PNG otherwise). Results
+    are cached by content hash, so a batch and its reruns only do this once.
+    """
+    if isinstance(logo_image, str):
+        with open(logo_image, "rb") as f:
+            logo_bytes = f.read()
+    elif isinstance(logo_image, bytes):
+        logo_bytes = logo_image
+    elif hasattr(logo_image, "getvalue"):
+        logo_bytes = logo_image.getvalue()
+    else:
+        logo_bytes = logo_image.read()
+
+    key = (hashlib.sha256(logo_bytes).hexdigest(), dpi)
+    with _prepared_logos_lock:
+        if key in _prepared_logos:
+            _prepared_logos.move_to_end(key)
+            return _prepared_logos[key]
+
+    from PIL import Image, ImageOps
+
+    image = Image.open(BytesIO(logo_bytes))
+    embeddable = image.format in ("JPEG", "PNG")
+    max_pixels = round(LOGO_SIZE_POINTS / 72 * dpi)
+    prepared = logo_bytes
+    if not embeddable or max(image.size) > max_pixels:
+        image = ImageOps.exif_transpose(image) # Phone photos are often stored rotated
+        image.thumbnail((max_pixels, max_pixels), Image.LANCZOS)
+        output = BytesIO()
+        if image.mode in ("RGBA", "LA", "P") or "transparency" in image.info:
+            image.save(output, format="PNG", optimize=True)
+        else:
+            image.convert("RGB").save(output, format="JPEG", quality=90, optimize=True)
+        if output.tell() < len(logo_bytes) or not embeddable:
+            prepared = output.getvalue()
+
+    with _prepared_logos_lock:
+        _prepared_logos[key] = prepared
+        while len(_prepared_logos) > LOGO_CACHE_SIZE:
+            _prepared_logos.popitem(last=False)
+    return prepared
+
+# How many marking-table and instruction layouts (one per configuration) to keep built and wrapped
+TABLE_CACHE_SIZE = 32
+_flowable_draw_lock = threading.Lock()
+
+def generate_exam_number(length=10):
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+@functools.lru_cache(maxsize=TABLE_CACHE_SIZE)
+def _kcse_standard_table_layout(table_scale, width, height, section_1_questions, section_2_questions,
+                                section_1_title, section_2_title, include_grand_total):
+    """Build and wrap the K.C.S.E. tables, returning (table, x, y offset below the examiner text) triples."""
+    # --- Table Dimensions ---
+    q_cell_width = 20 * table_scale
+    total_cell_width = 30 * table_scale
+    gt_label_width = 40 * table_scale
+    gt_score_width = 60 * table_scale
+    row_height = 25 * table_scale 
+    
+    # --- Table 1: Section I ---
+    col_widths_s1 = [q_cell_width] * section_1_questions + [total_cell_width]
+    
+    table_data_s1 = [
+        [section_1_title] + [''] * section_1_questions,
+        [str(i) for i in range(1, section_1_questions + 1)] + ['Total'],
+        [''] * (section_1_questions + 1)
+    ]
+    
+    table_s1 = Table(table_data_s1, colWidths=col_widths_s1, rowHeights=row_height)
+    table_s1_style = TableStyle([
+        ('GRID', (0,0), (-1,-1), 1, colors.black),
+        ('FONTSIZE', (0,0), (-1,-1), 9),
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('SPAN', (0,0), (section_1_questions,0)),
+        ('BACKGROUND', (0,0), (section_1_questions,0), colors.lightgrey),
+        ('FONTNAME', (0,0), (section_1_questions,0), 'Helvetica-Bold'),
+        ('FONTNAME', (0,1), (-1,1), 'Helvetica-Bold'),
+    ])
+    table_s1.setStyle(table_s1_style)
+
+    table_x_position = 60
+    table_s1_width, table_s1_height = table_s1.wrap(width, height)
+    table_s1_offset = table_s1_height + 10 # Add 10 points space below 'For Examiner's Use Only'
+
+    # --- Table 2: Section II ---
+    sec2_q_start = section_1_questions + 1
+    sec2_q_end = sec2_q_start + section_2_questions - 1
+
+    col_widths_s2 = [q_cell_width] * section_2_questions + [total_cell_width]
+
+    table_data_s2 = [
+        [section_2_title] + [''] * section_2_questions,
+        [str(i) for i in range(sec2_q_start, sec2_q_end + 1)] + ['Total'],
+        [''] * (section_2_questions + 1)
+    ]
+
+    table_s2 = Table(table_data_s2, colWidths=col_widths_s2, rowHeights=row_height)
+    table_s2_style = TableStyle([
+        ('GRID', (0,0), (-1,-1), 1, colors.black),
+        ('FONTSIZE', (0,0), (-1,-1), 9),
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('SPAN', (0,0), (section_2_questions,0)),
+        ('BACKGROUND', (0,0), (section_2_questions,0), colors.lightgrey),
+        ('FONTNAME', (0,0), (section_2_questions,0), 'Helvetica-Bold'),
+        ('FONTNAME', (0,1), (-1,1), 'Helvetica-Bold'),
+    ])
+    table_s2.setStyle(table_s2_style)
+
+    table_s2_width, table_s2_height = table_s2.wrap(width, height)
+    # Add 15 points space between Section I and Section II tables
+    table_s2_offset = table_s1_offset + table_s2_height + 15 
+
+    layout = [(table_s1, table_x_position, table_s1_offset), (table_s2, table_x_position, table_s2_offset)]
+
+    # --- Table 3: Grand Total (if included) ---
+    if include_grand_total:
+        col_widths_gt = [gt_label_width, gt_score_width]
+        
+        table_data_gt = [
+            ['GRAND', ''],
+            ['TOTAL', ''],
+            ['', '']
+        ]
+
+        table_gt = Table(table_data_gt, colWidths=col_widths_gt, rowHeights=[row_height, row_height, row_height])
+        table_gt_style = TableStyle([
+            ('GRID', (0,0), (-1,-1), 1, colors.black),
+            ('FONTSIZE', (0,0), (-1,-1), 9),
+            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('SPAN', (0,0), (0,1)), # 'GRAND' and 'TOTAL' label vertical span
+            ('SPAN', (1,0), (1,2)), # Grand Total score box vertical span
+            ('FONTNAME', (0,0), (0,1), 'Helvetica-Bold'),
+        ])
+        table_gt.setStyle(table_gt_style)
+
+        table_gt.wrap(width, height)
+        
+        # Position it to the right of Section II table, aligned at its top edge
+        table_gt_x_position = table_x_position + table_s2_width + 10 
+        layout.append((table_gt, table_gt_x_position, table_s2_offset)) # Align tops of Section II and Grand Total tables
+
+    return tuple(layout)
+
+def _draw_table_layout(c, layout, examiner_text_y):
+    # Cached tables are shared, and drawOn briefly stores the canvas on the table itself
+    with _flowable_draw_lock:
+        for table, x_position, y_offset in layout:
+            table.drawOn(c, x_position, examiner_text_y - y_offset)
+
+def draw_kcse_standard_marking_table(c, examiner_text_y, table_scale, width, height,
+                                       section_1_questions, section_2_questions,
+                                       section_1_title, section_2_title, include_grand_total):
+    layout = _kcse_standard_table_layout(table_scale, width, height,
+                                         int(section_1_questions), int(section_2_questions),
+                                         section_1_title, section_2_title, bool(include_grand_total))
+    _draw_table_layout(c, layout, examiner_text_y)
+
+    # Return the lowest Y position used by the tables
+    return examiner_text_y - layout[1][2] # or the grand total table if it extends lower
+
+@functools.lru_cache(maxsize=TABLE_CACHE_SIZE)
+def _custom_table_layout(table_rows, table_scale, width, height):
+    """Build and wrap the customized score sheet from its (already stringified) rows."""
+    # Column widths can be dynamic based on content or fixed for better appearance
+    # Adjusted widths to better fit the example image
+    col_widths = [80 * table_scale, 80 * table_scale, 60 * table_scale, 80 * table_scale]
+    row_height = 25 * table_scale
+
+    table = Table([list(row) for row in table_rows], colWidths=col_widths, rowHeights=row_height)
+    
+    table_style_list = [
+        ('GRID', (0,0), (-1,-1), 1, colors.black),
+        ('FONTSIZE', (0,0), (-1,-1), 9),
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey), # Header background
+        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'), # Header font bold
+    ]
+
+    # Apply specific styles for "TOTAL SCORE" row
+    for i, row_data in enumerate(table_rows):
+        if i > 0 and row_data[0].upper() == "TOTAL SCORE": # Check the 'Section' column for 'TOTAL SCORE'
+            # Span 'SECTION' and 'QUESTION' cells for 'TOTAL SCORE' row
+            table_style_list.append(('SPAN', (0, i), (1, i)))
+            table_style_list.append(('ALIGN', (0, i), (1, i), 'CENTER')) # Center merged cell
+            table_style_list.append(('FONTNAME', (0, i), (-1, i), 'Helvetica-Bold')) # Bold total row
+            table_style_list.append(('ALIGN', (2, i), (2, i), 'RIGHT')) # Align max score to right
+
+    table.setStyle(TableStyle(table_style_list))
+
+    table_x_position = 60
+    table_width, table_height = table.wrap(width, height)
+    return ((table, table_x_position, table_height + 10),) # Add 10 points space below 'For Examiner's Use Only'
+
+def custom_table_records(custom_table_df):
+    """Rows of the custom marking table as dicts, from a DataFrame or a plain list of dicts."""
+    if custom_table_df is None:
+        return []
+    if hasattr(custom_table_df, "to_dict"):
+        return custom_table_df.to_dict("records")
+    return list(custom_table_df)
+
+def draw_custom_marking_table(c, custom_table_df, examiner_text_y, table_scale, width, height):
+    # Header for the custom table
+    table_header = ("SECTION", "QUESTION", "MAXIMUM SCORE", "CANDIDATE'S SCORE")
+    
+    table_rows = []
+    # Add header
+    table_rows.append(table_header)
+
+    # Add data rows
+    for row in custom_table_records(custom_table_df):
+        section_val = str(row.get("Section", "")).strip()
+        question_val = str(row.get("Question", "")).strip()
+        max_score_val = str(row.get("Maximum Score", "")).strip()
+        table_rows.append((section_val, question_val, max_score_val, '')) # Candidate's score is empty
+
+    layout = _custom_table_layout(tuple(table_rows), table_scale, width, height)
+    _draw_table_layout(c, layout, examiner_text_y)
+
+    return examiner_text_y - layout[0][2] # Return the lowest Y position used by the table
+
+
+# Fonts registered on every canvas before the layout is recorded or replayed, so the
+# internal font names (/F1, /F2, ...) baked into a recorded layout stay valid.
+TEMPLATE_FONTS = ("Helvetica", "Helvetica-Bold")
+
+# Fixed geometry of the student-details block
+DETAILS_LEFT_X = 60
+DETAILS_RIGHT_X = 330
+
+# The student-details labels never change, so they are measured once
+DETAILS_LABEL_WIDTHS = {
+    label: stringWidth(label, "Helvetica", 11)
+    for label in ("Name:", "Index No.:", "School:", "Candidate's Signature:", "Stream:", "Date:")
+}
+
+@functools.lru_cache(maxsize=None)
+def _instruction_style():
+    # getSampleStyleSheet builds a whole new stylesheet on every call
+    return getSampleStyleSheet()['Normal']
+
+@functools.lru_cache(maxsize=TABLE_CACHE_SIZE)
+def _instructions_layout(instructions, start_y, width, height):
+    """Wrap the instructions and work out where each one goes, including any page breaks.
+
+    Returns (pages, end_y): one tuple of (paragraph, y) placements per page, and
+    the y position below the last instruction.
+    """
+    style = _instruction_style()
+    p_width = width - 120 # 60 from each side
+    pages = [[]]
+    iy = start_y
+    for line in instructions:
+        p = Paragraph(line, style)
+        _, p_height = p.wrap(p_width, height)
+
+        # Check if drawing this paragraph would go off the page
+        if iy - p_height < 60: # If it's too close to the bottom margin (e.g., 60 points)
+            pages.append([])
+            iy = height - 60 # Reset y for new page
+
+        pages[-1].append((p, iy - p_height)) # Draw paragraph at current y, adjusted for its height
+        iy -= (p_height + 8) # Move y down for next paragraph, adding 8 points extra space
+    return tuple(tuple(page) for page in pages), iy
+
+class _RecordingCanvas(canvas.Canvas):
+    """Canvas that keeps a copy of every page's drawing operations."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recorded_pages = []
+
+    def showPage(self):
+        self.recorded_pages.append(list(self._code))
+        super().showPage()
+
+def new_exam_canvas(buffer, fonts=TEMPLATE_FONTS, canvas_class=canvas.Canvas):
+    c = canvas_class(buffer, pagesize=A4)
+    for font_name in fonts:
+        c._doc.getInternalFontName(font_name)
+    return c
+
+def draw_exam_layout(
+    c, form, subject, term, exam_name, exam_date, duration, raw_instructions,
+    marking_table_style, school_name, paper_code, table_scale,
+    section_1_questions, section_2_questions, section_1_title, section_2_title, include_grand_total,
+    custom_table_df, prefill_student_details
+):
+    """Draw everything on the exam page that is the same for every student."""
+    width, height = A4
+
+    # Page Number
+    c.setFont("Helvetica", 9)
+    c.drawString(width - 70, height - 30, "1")
+
+    y = height - 80
+
+    # Header information
+    c.setFont("Helvetica-Bold", 14)
+    c.drawCentredString(width / 2, y, EXAM_HEADER)
+
+    c.setFont("Helvetica-Bold", 13)
+    c.drawCentredString(width / 2, y - 20, school_name.upper())
+    
+    # Paper Code and Subject Title
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(60, y - 40, paper_code)
+    c.drawCentredString(width / 2, y - 40, f"{form.upper()} {subject.upper()}")
+    c.drawCentredString(width / 2, y - 60, f"{term} – {exam_name}")
+    
+    # Time
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(width - 150, y - 60, f"TIME: {duration}")
+
+    # --- Student details (Dashed Lines Under Names) ---
+    c.setFont("Helvetica", 11)
+    
+    line_start_x_left_section = DETAILS_LEFT_X
+    line_end_x_left_section = 320 
+    line_start_x_right_section = DETAILS_RIGHT_X
+    line_end_x_right_section = width - 60 
+    line_thickness = 0.5 
+
+    c.setLineWidth(line_thickness)
+    c.setDash(1, 2) # Set dashed line pattern (1 unit on, 2 units off)
+
+    # Name
+    current_y = y - 90
+    c.drawString(line_start_x_left_section, current_y, "Name:")
+    name_label_width = DETAILS_LABEL_WIDTHS["Name:"]
+    # Draw dashed line for name
+    c.line(line_start_x_left_section + name_label_width + 5, current_y - 2, line_end_x_left_section, current_y - 2)
+
+    # Index No.
+    c.drawString(line_start_x_right_section, current_y, "Index No.:")
+    index_label_width = DETAILS_LABEL_WIDTHS["Index No.:"]
+    # Draw dashed line for index
+    c.line(line_start_x_right_section + index_label_width + 5, current_y - 2, line_end_x_right_section, current_y - 2)
+
+    # School
+    current_y -= 20 
+    c.drawString(line_start_x_left_section, current_y, "School:")
+    school_label_width = DETAILS_LABEL_WIDTHS["School:"]
+    # Draw dashed line for school
+    c.line(line_start_x_left_section + school_label_width + 5, current_y - 2, line_end_x_left_section, current_y - 2)
+    # School name is always pre-filled
+    c.drawString(line_start_x_left_section + school_label_width + 5, current_y, school_name)
+
+    # Candidate's Signature
+    c.drawString(line_start_x_right_section, current_y, "Candidate's Signature:")
+    sig_label_width = DETAILS_LABEL_WIDTHS["Candidate's Signature:"]
+    # Draw dashed line for signature
+    c.line(line_start_x_right_section + sig_label_width + 5, current_y - 2, line_end_x_right_section, current_y - 2)
+    
+    # Stream
+    current_y -= 20 
+    c.drawString(line_start_x_left_section, current_y, "Stream:")
+    stream_label_width = DETAILS_LABEL_WIDTHS["Stream:"]
+    # Draw dashed line for stream
+    c.line(line_start_x_left_section + stream_label_width + 5, current_y - 2, line_end_x_left_section, current_y - 2)
+
+    # Date
+    current_y -= 20 
+    c.drawString(line_start_x_left_section, current_y, "Date:")
+    date_label_width = DETAILS_LABEL_WIDTHS["Date:"]
+    # Draw dashed line for date
+    c.line(line_start_x_left_section + date_label_width + 5, current_y - 2, line_end_x_left_section, current_y - 2)
+    # Date is always pre-filled
+    c.drawString(line_start_x_left_section + date_label_width + 5, current_y, exam_date)
+
+    # Reset line styles
+    c.setDash() # Turn off dashes
+    c.setLineWidth(1)
+
+    # --- Instructions Handling (Dynamic First Instruction) ---
+    current_instructions = list(raw_instructions) # Create a mutable copy
+
+    if prefill_student_details:
+        # Modify the first instruction if pre-filling
+        if len(current_instructions) > 0 and "Write your name and index number" in current_instructions[0]:
+            current_instructions[0] = "1. Verify your name and index number in the spaces provided above."
+    # Else, if not pre-filling, the original instruction "Write your name..." remains.
+
+    c.setFont("Helvetica-Bold", 11)
+    iy = current_y - 40 # Adjust starting Y for instructions based on where student details ended
+    c.drawString(60, iy, "INSTRUCTIONS TO CANDIDATES")
+    
+    c.setFont("Helvetica", 10)
+    iy -= 20 # Initial vertical space before first instruction
+    # Wrapped once per set of instructions; the cached paragraphs are shared like the tables
+    pages, iy = _instructions_layout(tuple(current_instructions), iy, width, height)
+    for page_index, placements in enumerate(pages):
+        if page_index > 0:
+            c.showPage() # Start a new page
+            # Re-draw page number for new pages (basic for now, more complex if many pages)
+            c.setFont("Helvetica", 9)
+            c.drawString(width - 70, height - 30, "Page X") 
+            c.setFont("Helvetica", 10)
+        with _flowable_draw_lock:
+            for p, p_y in placements:
+                p.drawOn(c, 60, p_y)
+
+
+    # --- For Examiner's Use Only Table ---
+    if marking_table_style != "None": # Only draw if a marking table style is selected
+        c.setFont("Helvetica-Bold", 12)
+        examiner_text_y = iy - 20 # Adjusted vertical spacing from instructions
+        c.drawString(60, examiner_text_y, "For Examiner's Use Only")
+
+        if marking_table_style == "K.C.S.E. Standard (Section I, Section II, Grand Total)":
+            draw_kcse_standard_marking_table(c, examiner_text_y, table_scale, width, height,
+                                              section_1_questions, section_2_questions,
+                                              section_1_title, section_2_title, include_grand_total)
+        elif marking_table_style == "Customized Score Sheet":
+            if custom_table_records(custom_table_df):
+                draw_custom_marking_table(c, custom_table_df, examiner_text_y, table_scale, width, height)
+            else:
+                logger.warning("No data provided for custom marking table. Skipping table generation.")
+
+def draw_student_fields(c, student_name, adm_no, stream, include_exam_number, prefill_student_details, exam_number=None):
+    """Stamp the per-student values onto an already drawn page layout.
+
+    Without an allocated ``exam_number`` a random one is drawn for the page.
+    """
+    width, height = A4
+    y = height - 80
+    current_y = y - 90
+
+    c.setFont("Helvetica", 11)
+    # Name, Index No. and Stream are drawn over the dashed lines ONLY if prefill_student_details is True
+    if prefill_student_details:
+        c.drawString(DETAILS_LEFT_X + DETAILS_LABEL_WIDTHS["Name:"] + 5, current_y, student_name)
+        c.drawString(DETAILS_RIGHT_X + DETAILS_LABEL_WIDTHS["Index No.:"] + 5, current_y, adm_no)
+        c.drawString(DETAILS_LEFT_X + DETAILS_LABEL_WIDTHS["Stream:"] + 5, current_y - 40, stream)
+
+    # Exam Number (Bolded), on the same line as the date
+    if include_exam_number:
+        c.setFont("Helvetica-Bold", 11) # Bold for exam number
+        c.drawString(DETAILS_RIGHT_X, current_y - 60, f"Exam Number: {exam_number or generate_exam_number()}")
+        c.setFont("Helvetica", 11) # Reset font
+
+class ExamPageTemplate:
+    """Exam page layout rendered once per batch and replayed for every student.
+
+    The static part of the page (header, dashed lines, instructions and marking
+    table) is recorded once as PDF drawing operations. Each student page then
+    defines that recording as a form XObject, places it with ``doForm`` and only
+    draws the logo and the student's own fields on top.
+    """
+
+    def __init__(
+        self, form, subject, term, exam_name, exam_date, duration, logo_image, raw_instructions,
+        marking_table_style, include_exam_number, school_name, paper_code, total_pages_count, table_scale,
+        section_1_questions, section_2_questions, section_1_title, section_2_title, include_grand_total,
+        custom_table_df, prefill_student_details
+    ):
+        self.include_exam_number = include_exam_number
+        self.prefill_student_details = prefill_student_details
+        self.logo = ImageReader(BytesIO(prepare_logo(logo_image))) if logo_image else None
+
+        recorder = new_exam_canvas(BytesIO(), canvas_class=_RecordingCanvas)
+        draw_exam_layout(
+            recorder, form, subject, term, exam_name, exam_date, duration, raw_instructions,
+            marking_table_style, school_name, paper_code, table_scale,
+            section_1_questions, section_2_questions, section_1_title, section_2_title, include_grand_total,
+            custom_table_df, prefill_student_details
+        )
+        recorder.showPage()
+        self.fonts = tuple(recorder._doc.fontMapping.items())
+        self.pages = recorder.recorded_pages
+
+        digest = hashlib.md5("\n".join(op for page in self.pages for op in page).encode("utf-8")).hexdigest()
+        self.form_names = [f"ExamLayout{digest[:12]}P{i}" for i in range(len(self.pages))]
+
+    def new_canvas(self, buffer):
+        return new_exam_canvas(buffer, fonts=[font_name for font_name, _ in self.fonts])
+
+    def _define_forms(self, c):
+        if c.hasForm(self.form_names[0]):
+            return
+        for font_name, internal_name in self.fonts:
+            if c._doc.getInternalFontName(font_name) != internal_name:
+                raise ValueError("Canvas fonts do not match the recorded layout; create it with new_canvas().")
+        for form_name, ops in zip(self.form_names, self.pages):
+            c.beginForm(form_name)
+            c._code.extend(ops)
+            c.endForm()
+
+    def draw(self, c, student_name, adm_no, stream, exam_number=None):
+        """Draw one student's pages onto ``c``, ending each page with ``showPage``."""
+        self._define_forms(c)
+        width, height = A4
+        for page_index, form_name in enumerate(self.form_names):
+            c.doForm(form_name)
+            if page_index == 0:
+                # Draw logo if provided
+                if self.logo:
+                    c.drawImage(self.logo, 60, height - 90, width=60, height=60, preserveAspectRatio=True)
+                draw_student_fields(c, student_name, adm_no, stream,
+                                    self.include_exam_number, self.prefill_student_details, exam_number)
+            c.showPage()
+
+    def render(self, student_name, adm_no, stream, exam_number=None):
+        buffer = BytesIO()
+        c = self.new_canvas(buffer)
+        self.draw(c, student_name, adm_no, stream, exam_number)
+        c.save()
+        buffer.seek(0)
+        return buffer
+
+def generate_exam_pdf(
+    student_name, adm_no, stream, form, subject, term, exam_name, exam_date,
+    duration, logo_image, raw_instructions, marking_table_style, include_exam_number,
+    school_name, paper_code, total_pages_count, table_scale,
+    section_1_questions, section_2_questions, section_1_title, section_2_title, include_grand_total,
+    custom_table_df, # New parameter for custom table data
+    prefill_student_details,
+    exam_number=None
+):
+    template = ExamPageTemplate(
+        form=form, subject=subject, term=term, exam_name=exam_name, exam_date=exam_date,
+        duration=duration, logo_image=logo_image, raw_instructions=raw_instructions,
+        marking_table_style=marking_table_style, include_exam_number=include_exam_number,
+        school_name=school_name, paper_code=paper_code, total_pages_count=total_pages_count,
+        table_scale=table_scale, section_1_questions=section_1_questions,
+        section_2_questions=section_2_questions, section_1_title=section_1_title,
+        section_2_title=section_2_title, include_grand_total=include_grand_total,
+        custom_table_df=custom_table_df, prefill_student_details=prefill_student_details
+    )
+    return template.render(student_name, adm_no, stream, exam_number)
@@ -0,0 +1,256 @@
+import io
+import re
+import csv
+import math
+import bisect
+from contextlib import closing
+from collections import namedtuple
+
+# One roster row, as handed to the batch workers (must stay picklable). exam_number is
+# filled in by exam_numbers.assign_exam_numbers; without it each page gets a random one.
+StudentRecord = namedtuple("StudentRecord", ["student_name", "adm_no", "stream", "exam_number"], defaults=(None,))
+
+# What a row gets when its name, admission number or stream cell is empty
+MISSING_NAME = "Unknown"
+MISSING_ADM_NO = "N/A"
+MISSING_STREAM = "N/A"
+
+# Whitespace, path separators, characters Windows refuses in file names and control characters
+_UNSAFE_FILENAME_CHARS = re.compile(r'[\s/\\:*?"<>|\x00-\x1f]+')
+
+# How many students a roster problem lists by name before summarising the rest
+PROBLEM_EXAMPLES = 5
+
+# Tried in order: UTF-8 (utf-8-sig also copes with the BOM of Excel's "CSV UTF-8"), then the Windows
+# code page of Excel's plain "CSV" and finally latin-1, which accepts any byte
+CSV_ENCODINGS = ("utf-8-sig", "cp1252", "latin-1")
+
+class RosterColumnsError(ValueError):
+    """The roster has no recognisable name or admission/index number column."""
+
+def detect_roster_columns(columns):
+    """Find the name, admission/index number and stream columns among normalised header names.
+
+    Returns (name_col, adm_col, stream_col); stream_col is None when the roster has no stream.
+    """
+    name_col = next((col for col in columns if "name" in col), None)
+    adm_col = next((col for col in columns if "admission" in col or "adm" in col or "index" in col), None)
+    stream_col = next((col for col in columns if "stream" in col), None)
+
+    if not all([name_col, adm_col]):
+        raise RosterColumnsError("The roster needs a name column and an admission or index number column.")
+    return name_col, adm_col, stream_col
+
+def _excel_rows(student_file):
+    from openpyxl import load_workbook
+
+    # read_only streams the sheet XML row by row instead of building the whole workbook
+    workbook = load_workbook(student_file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        # read_only trusts the sheet's stored dimension, which some writers get wrong and would cut rows off
+        sheet.reset_dimensions()
+        yield from sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def _decoded_csv_rows(student_file, encoding):
+    if isinstance(student_file, str):
+        with open(student_file, newline="", encoding=encoding) as f:
+            yield from csv.reader(f)
+    else:
+        student_file.seek(0)
+        text = io.TextIOWrapper(student_file, encoding=encoding, newline="")
+        try:
+            yield from csv.reader(text)
+        finally:
+            text.detach()
+
+def _csv_rows(student_file):
+    # A file that turns out not to be UTF-8 is read again in the next encoding, skipping the rows
+    # already yielded (the row breaks are plain ASCII, so they fall in the same places)
+    rows_read = 0
+    for encoding in CSV_ENCODINGS:
+        try:
+            for n, row in enumerate(_decoded_csv_rows(student_file, encoding)):
+                if n >= rows_read:
+                    rows_read += 1
+                    yield row
+            return
+        except UnicodeDecodeError:
+            continue
+
+def _cell_text(row, index, default):
+    if index is None or index >= len(row) or row[index] is None:
+        return default
+    value = row[index]
+    if isinstance(value, float):
+        if math.isnan(value):
+            return default
+        if value.is_integer():
+            value = int(value) # Admission numbers stored as 1234.0
+    # Trims the ends and collapses runs of spaces, tabs and line breaks inside the cell
+    return " ".join(str(value).split()) or default
+
+def iter_sheet_rows(sheet_file, filename=None):
+    """Yield the raw rows of a spreadsheet, header row included.
+
+    ``sheet_file`` is a path or a file-like object (such as a Streamlit upload);
+    ``.csv`` files are read with the csv module and anything else as an Excel
+    workbook (first sheet).
+    """
+    filename = filename or getattr(sheet_file, "name", sheet_file)
+    if hasattr(sheet_file, "seek"):
+        sheet_file.seek(0) # Streamlit hands back the same upload object on every rerun
+    if isinstance(filename, str) and filename.lower().endswith(".csv"):
+        return _csv_rows(sheet_file)
+    return _excel_rows(sheet_file)
+
+def is_blank_row(row):
+    return all(cell is None or str(cell).strip() == "" for cell in row)
+
+def iter_roster(student_file, filename=None):
+    """Yield a StudentRecord per roster row without loading the whole file.
+
+    The file is read with iter_sheet_rows. The name/admission/stream columns are
+    detected once from the header row, and completely empty rows are skipped.
+    """
+    rows = iter_sheet_rows(student_file, filename)
+    with closing(rows):
+        header = next(rows, None)
+        if header is None:
+            raise RosterColumnsError("The roster is empty.")
+        columns = [str(col).strip().lower() if col is not None else "" for col in header]
+        name_col, adm_col, stream_col = detect_roster_columns(columns)
+        name_index = columns.index(name_col)
+        adm_index = columns.index(adm_col)
+        stream_index = columns.index(stream_col) if stream_col else None
+
+        for row in rows:
+            if is_blank_row(row):
+                continue
+            yield StudentRecord(
+                _cell_text(row, name_index, MISSING_NAME),
+                _cell_text(row, adm_index, MISSING_ADM_NO),
+                _cell_text(row, stream_index, MISSING_STREAM),
+            )
+
+def load_roster(student_file, filename=None):
+    """Read an Excel or CSV roster (path or file-like object) into a list of StudentRecord."""
+    return list(iter_roster(student_file, filename))
+
+def safe_filename_part(text):
+    return _UNSAFE_FILENAME_CHARS.sub("_", str(text)).strip("._") or "_"
+
+def pdf_filename(student_name, adm_no):
+    return f"{safe_filename_part(student_name)}_{safe_filename_part(adm_no)}.pdf"
+
+def unique_filenames(filenames):
+    """Number repeated file names (name_2.pdf, name_3.pdf, ...) so none overwrites another.
+
+    Names are compared ignoring case, as Windows and macOS do when a ZIP is extracted.
+    """
+    seen = set()
+    unique = []
+    for filename in filenames:
+        stem, dot, extension = filename.rpartition(".")
+        if not dot:
+            stem, extension = filename, ""
+        candidate, n = filename, 1
+        while candidate.lower() in seen:
+            n += 1
+            candidate = f"{stem}_{n}{dot}{extension}"
+        seen.add(candidate.lower())
+        unique.append(candidate)
+    return unique
+
+def _examples(values):
+    values = list(values)
+    shown = ", ".join(values[:PROBLEM_EXAMPLES])
+    return shown + (f" and {len(values) - PROBLEM_EXAMPLES} more" if len(values) > PROBLEM_EXAMPLES else "")
+
+def roster_problems(records):
+    """Plain-language descriptions of roster rows that would print badly or clash with each other.
+
+    Meant to be shown before rendering starts; none of them stops generation.
+    """
+    records = list(records)
+    problems = []
+
+    unnamed = [record.adm_no for record in records if record.student_name == MISSING_NAME]
+    if unnamed:
+        problems.append(f"{len(unnamed)} student(s) have no name (admission numbers {_examples(unnamed)}).")
+    no_adm_no = [record.student_name for record in records if record.adm_no == MISSING_ADM_NO]
+    if no_adm_no:
+        problems.append(f"{len(no_adm_no)} student(s) have no admission number ({_examples(no_adm_no)}); "
+                        "they get a new random exam number every time.")
+
+    by_adm_no = {}
+    for record in records:
+        if record.adm_no != MISSING_ADM_NO:
+            by_adm_no.setdefault(record.adm_no, []).append(record)
+    for adm_no, shared in by_adm_no.items():
+        if len(shared) < 2:
+            continue
+        names = list(dict.fromkeys(record.student_name for record in shared))
+        if len(names) == 1:
+            problems.append(f"{names[0]} ({adm_no}) is listed {len(shared)} times.")
+        else:
+            problems.append(f"Admission number {adm_no} is used by {len(shared)} rows ({_examples(names)}); "
+                            "they will get the same exam number.")
+
+    # Different students whose file names only differ in characters that are not allowed in file names
+    by_filename = {}
+    for record in records:
+        by_filename.setdefault(pdf_filename(record.student_name, record.adm_no).lower(), set()).add(
+            (record.student_name, record.adm_no))
+    for filename, students in by_filename.items():
+        if len(students) > 1 and len({adm_no for _, adm_no in students}) > 1:
+            problems.append(f"{_examples(f'{name} ({adm_no})' for name, adm_no in sorted(students))} would be saved "
+                            "under the same file name; numbered copies (_2, _3, ...) are used instead.")
+    return problems
+
+class RosterIndex:
+    """Roster positions by admission number, name and stream, built once when a roster is loaded.
+
+    search() finds students by the start of any word of their name or of their
+    admission number, without scanning the whole roster; the positions it
+    returns index into ``records``.
+    """
+
+    def __init__(self, records):
+        self.records = list(records)
+        self._by_adm_no = {}
+        self._by_stream = {}
+        by_word = {}
+        for position, record in enumerate(self.records):
+            self._by_adm_no.setdefault(record.adm_no.casefold(), []).append(position)
+            self._by_stream.setdefault(record.stream, []).append(position)
+            for word in {*record.student_name.casefold().split(), record.adm_no.casefold()}:
+                by_word.setdefault(word, []).append(position)
+        self._words = sorted(by_word)
+        self._word_positions = [by_word[word] for word in self._words]
+
+    @property
+    def streams(self):
+        return list(self._by_stream)
+
+    def find(self, adm_no):
+        """Positions of the students with exactly this admission number."""
+        return list(self._by_adm_no.get(str(adm_no).strip().casefold(), ()))
+
+    def _prefix_matches(self, prefix):
+        start = bisect.bisect_left(self._words, prefix)
+        end = bisect.bisect_left(self._words, prefix + "\U0010ffff")
+        return {position for positions in self._word_positions[start:end] for position in positions}
+
+    def search(self, text="", stream=None):
+        """Positions, in roster order, of the students matching every word of ``text`` (and ``stream``, if given)."""
+        matches = None
+        for prefix in text.casefold().split():
+            found = self._prefix_matches(prefix)
+            matches = found if matches is None else matches & found
+        if stream is not None:
+            in_stream = self._by_stream.get(stream, [])
+            return [position for position in in_stream if matches is None or position in matches]
+        return sorted(matches) if matches is not None else list(range(len(self.records)))
@@ -0,0 +1,358 @@
+"""Serve exam top pages over HTTP to other systems on this machine, without the Streamlit app.
+
+    python -m exam_service --port 8765
+
+Requests and errors are JSON; ``config`` takes the same keys as the command
+line config file, with the logo sent as base64 in ``logo_base64``.
+
+    GET  /health
+    POST /page   {"config": {...}, "student": {"student_name": ..., "adm_no": ..., "stream": ...}}
+                 -> application/pdf
+    POST /batch  {"config": {...}, "students": [{...}, ...]}
+                 or {"config": {...}, "roster": "<base64 .xlsx/.csv>", "roster_filename": "students.xlsx"}
+                 optional "output": "zip" (default), "class_set" or "class_sets_by_stream"
+                 optional "select": {"adm_nos": [...]} or {"search": "jane", "stream": "EAST"}
+                 to render only some students of the roster (zip output only)
+                 -> application/zip or application/pdf, streamed while it is generated
+
+A ``papers`` list in a batch config works as in the command line: a ZIP with a
+folder per paper. Batches render on a worker pool, at most MAX_CONCURRENT_BATCHES
+at a time and leaving a core for single pages; requests over the limits get
+429 Too Many Requests.
+"""
+import argparse
+import base64
+import binascii
+import json
+import logging
+import sys
+import threading
+import unicodedata
+import zipfile
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import quote
+
+from openpyxl.utils.exceptions import InvalidFileException
+
+from exam_render import ExamPageTemplate, prepare_logo
+from exam_roster import (
+    MISSING_ADM_NO, MISSING_NAME, MISSING_STREAM, RosterIndex, StudentRecord, load_roster, pdf_filename,
+)
+from exam_manifest import exam_config_from_dict, paper_exam_configs
+from exam_batch import default_worker_count, render_batch, render_class_sets, render_papers, write_batch_zip
+from exam_cache import PdfCache, config_fingerprint
+from exam_numbers import number_paper_rosters
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+
+# Large rosters with a photographed logo stay well below this
+MAX_REQUEST_BYTES = 50 * 1024 * 1024
+
+# A batch owns a worker pool; more than this many at once are turned away
+MAX_CONCURRENT_BATCHES = 1
+
+# Single pages render in the request thread; requests wait this long for a free slot
+MAX_CONCURRENT_PAGES = 8
+PAGE_SLOT_TIMEOUT_SECONDS = 10
+
+# Page layouts kept for single-page requests, keyed on the exam config
+TEMPLATE_CACHE_SIZE = 16
+
+# Streamed responses are sent in chunks of about this size
+STREAM_CHUNK_BYTES = 64 * 1024
+
+class RequestError(ValueError):
+    """A problem with the request itself, reported to the client as 400 Bad Request."""
+
+class _ChunkedResponse:
+    """Write-only file object that sends what is written to it as HTTP/1.1 chunks.
+
+    It cannot seek, so zipfile writes the archive as a stream (with data
+    descriptors) instead of going back to patch the entry headers.
+    """
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= STREAM_CHUNK_BYTES:
+            self.flush()
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def seek(self, *args):
+        raise OSError("A streamed response cannot seek")
+
+    def flush(self):
+        if self._buffer:
+            self._wfile.write(b"%X\r\n%s\r\n" % (len(self._buffer), bytes(self._buffer)))
+            self._buffer.clear()
+
+    def finish(self):
+        self.flush()
+        self._wfile.write(b"0\r\n\r\n")
+
+_templates = OrderedDict()
+_templates_lock = threading.Lock()
+
+def _page_template(exam_config):
+    key = config_fingerprint(exam_config)
+    with _templates_lock:
+        if key in _templates:
+            _templates.move_to_end(key)
+            return _templates[key]
+    template = ExamPageTemplate(**exam_config)
+    with _templates_lock:
+        _templates[key] = template
+        while len(_templates) > TEMPLATE_CACHE_SIZE:
+            _templates.popitem(last=False)
+    return template
+
+def _check_settings(settings):
+    # Logos come inline; a path would let clients read files on the server
+    if not isinstance(settings, dict):
+        raise RequestError("config and papers must be JSON objects")
+    if "logo" in settings:
+        raise RequestError("send the logo as base64 in logo_base64, not as a file path")
+    return settings
+
+def _settings_config(settings):
+    """Exam config from the request's config settings."""
+    _check_settings(settings)
+    exam_config = exam_config_from_dict({key: value for key, value in settings.items() if key != "papers"})
+    if settings.get("logo_base64"):
+        try:
+            exam_config["logo_image"] = prepare_logo(base64.b64decode(settings["logo_base64"], validate=True))
+        except (binascii.Error, OSError) as e:
+            raise RequestError(f"logo_base64 is not a readable image: {e}")
+    return exam_config
+
+def _student_record(student):
+    if not isinstance(student, dict):
+        raise RequestError("each student must be a JSON object")
+    return StudentRecord(
+        " ".join(str(student.get("student_name") or "").split()) or MISSING_NAME,
+        " ".join(str(student.get("adm_no") or "").split()) or MISSING_ADM_NO,
+        " ".join(str(student.get("stream") or "").split()) or MISSING_STREAM,
+    )
+
+def _content_disposition(disposition, filename):
+    # Header values go out as Latin-1, so non-ASCII names (e.g. "Wanjikũ") get an ASCII
+    # fallback plus the RFC 6266 UTF-8 form that current clients prefer
+    fallback = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii").replace('"', "_")
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+def _batch_records(body):
+    if "students" in body:
+        return [_student_record(student) for student in body["students"]]
+    if "roster" in body:
+        try:
+            roster = base64.b64decode(body["roster"], validate=True)
+        except binascii.Error:
+            raise RequestError("roster must be base64")
+        try:
+            return load_roster(BytesIO(roster), body.get("roster_filename", "roster.xlsx"))
+        except (zipfile.BadZipFile, InvalidFileException, OSError) as e:
+            raise RequestError(f"the roster could not be read as a spreadsheet: {e}")
+    raise RequestError("send the roster as students (a list) or roster (base64 .xlsx/.csv)")
+
+def _selected_positions(records, select):
+    if not isinstance(select, dict):
+        raise RequestError("select must be a JSON object")
+    index = RosterIndex(records)
+    if "adm_nos" in select:
+        if not isinstance(select["adm_nos"], list):
+            raise RequestError("select adm_nos must be a list")
+        positions = {position for adm_no in select["adm_nos"] for position in index.find(adm_no)}
+    else:
+        positions = set(index.search(str(select.get("search", "")), select.get("stream")))
+    if not positions:
+        raise RequestError("no students in the roster match select")
+    return positions
+
+class ExamServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Needed for chunked responses
+    server_version = "ExamTopPages"
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status, payload, headers=()):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, message, headers=()):
+        self._send_json(status, {"error": message}, headers)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_REQUEST_BYTES:
+            self.close_connection = True
+            raise RequestError(f"request body is larger than {MAX_REQUEST_BYTES // (1024 * 1024)} MB")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            raise RequestError(f"request body is not valid JSON: {e}")
+        if not isinstance(body, dict):
+            raise RequestError("request body must be a JSON object")
+        return body
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(HTTPStatus.OK, {"status": "ok"})
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, f"no such endpoint: {self.path}")
+
+    def do_POST(self):
+        handlers = {"/page": self._handle_page, "/batch": self._handle_batch}
+        handler = handlers.get(self.path)
+        if handler is None:
+            self.close_connection = True
+            self._send_error(HTTPStatus.NOT_FOUND, f"no such endpoint: {self.path}")
+            return
+        try:
+            handler(self._read_json())
+        except ValueError as e: # RequestError, RosterColumnsError and unusable config values
+            self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+        except Exception:
+            logger.exception("Request to %s failed", self.path)
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, "the PDFs could not be generated")
+
+    def _handle_page(self, body):
+        if not self.server.page_slots.acquire(timeout=PAGE_SLOT_TIMEOUT_SECONDS):
+            self._send_error(HTTPStatus.TOO_MANY_REQUESTS, "too many pages are being generated; try again shortly",
+                             headers=[("Retry-After", "1")])
+            return
+        try:
+            exam_config = _settings_config(body.get("config", {}))
+            record = _student_record(body.get("student", {}))
+            [(_, [record])] = number_paper_rosters([record], [exam_config], self.server.exam_number_index)
+            pdf = _page_template(exam_config).render(record.student_name, record.adm_no, record.stream,
+                                                     record.exam_number).getvalue()
+        finally:
+            self.server.page_slots.release()
+
+        # Built before send_response, so nothing can fail once the status line is buffered
+        disposition = _content_disposition("inline", pdf_filename(record.student_name, record.adm_no))
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Disposition", disposition)
+        self.send_header("Content-Length", str(len(pdf)))
+        self.end_headers()
+        self.wfile.write(pdf)
+
+    def _handle_batch(self, body):
+        if not self.server.batch_slots.acquire(blocking=False):
+            self._send_error(HTTPStatus.TOO_MANY_REQUESTS, "another batch is being generated; try again shortly",
+                             headers=[("Retry-After", "10")])
+            return
+        try:
+            self._stream_batch(body)
+        finally:
+            self.server.batch_slots.release()
+
+    def _stream_batch(self, body):
+        settings = body.get("config", {})
+        output = body.get("output", "zip")
+        if output not in ("zip", "class_set", "class_sets_by_stream"):
+            raise RequestError("output must be zip, class_set or class_sets_by_stream")
+        exam_config = _settings_config(settings)
+        paper_configs = None
+        if settings.get("papers"):
+            paper_configs = paper_exam_configs(exam_config, [_check_settings(paper) for paper in settings["papers"]])
+        records = _batch_records(body)
+        if not records:
+            raise RequestError("the roster has no students")
+        only = None
+        if "select" in body:
+            if output != "zip":
+                raise RequestError("select only works with zip output")
+            only = _selected_positions(records, body["select"])
+        paper_rosters = number_paper_rosters(records, paper_configs or [exam_config], self.server.exam_number_index)
+
+        workers = self.server.batch_workers
+        cache = PdfCache() if output == "zip" else None
+        if paper_configs:
+            pdf_files = render_papers(paper_rosters, class_sets=output != "zip",
+                                      split_by_stream=output == "class_sets_by_stream", workers=workers, cache=cache,
+                                      only=only)
+        elif output == "zip":
+            pdf_files = render_batch(paper_rosters[0][1], exam_config, workers=workers, cache=cache, only=only)
+        else:
+            pdf_files = render_class_sets(paper_rosters[0][1], exam_config,
+                                          split_by_stream=output == "class_sets_by_stream", workers=workers)
+
+        single_pdf = output == "class_set" and not paper_configs
+        filename = "Personalized_Exam_Top_Pages.pdf" if single_pdf else "Personalized_Exam_Top_Pages.zip"
+        disposition = _content_disposition("attachment", filename)
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/pdf" if single_pdf else "application/zip")
+        self.send_header("Content-Disposition", disposition)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        response = _ChunkedResponse(self.wfile)
+        try:
+            if single_pdf:
+                for _, pdf_bytes in pdf_files:
+                    response.write(pdf_bytes)
+            else:
+                write_batch_zip(pdf_files, response)
+            response.finish()
+        except Exception:
+            # The status line is already sent; dropping the connection tells the client the body is incomplete
+            logger.exception("Batch failed while streaming")
+            self.close_connection = True
+
+class ExamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, max_batches=MAX_CONCURRENT_BATCHES, max_pages=MAX_CONCURRENT_PAGES,
+                 batch_workers=None, exam_number_index=None):
+        super().__init__(address, ExamServiceHandler)
+        self.batch_slots = threading.BoundedSemaphore(max_batches)
+        self.page_slots = threading.BoundedSemaphore(max_pages)
+        # Leave a core to the request threads, so single pages stay quick while a batch runs
+        self.batch_workers = batch_workers or max(1, default_worker_count() - 1)
+        self.exam_number_index = exam_number_index
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m exam_service", description="Serve exam top pages over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: this machine only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--max-batches", type=int, default=MAX_CONCURRENT_BATCHES, help="Batches generated at the same time")
+    parser.add_argument("--max-pages", type=int, default=MAX_CONCURRENT_PAGES, help="Single pages generated at the same time")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes per batch (default: all CPU cores but one)")
+    parser.add_argument("--exam-number-index", default=None, help="SQLite file that remembers each candidate's exam number")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    server = ExamServer((args.host, args.port), args.max_batches, args.max_pages, args.workers, args.exam_number_index)
+    logger.info("Serving exam top pages on http://%s:%s", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())